@@ -30,11 +30,25 @@ __license__ = "MIT License"
 
 import sqlite3, re, sys
 import copy, warnings
+import contextlib
 import logging
 import collections
-from datetime import datetime
+import operator
+import weakref
+import json
+import math
+from datetime import datetime, date, time
+try:    # google-re2 matches patterns without backtracking, optional for re2_regexp()
+    import re2
+    _RE2_OPTIONS = re2.Options()
+    _RE2_OPTIONS.log_errors = False
+except (ImportError, AttributeError): re2 = None
 
 PY3K = sys.version_info.major >= 3
+# Names of fields are interned, they are keys of Model._data.
+if PY3K: _intern = sys.intern
+else:
+    def _intern(s): return intern(s) if type(s) is str else s  # unicode can not be interned
 
 # --- Exceptions
 class ObjectDoesNotExist(Exception): pass
@@ -59,19 +73,50 @@ _pre_field_order = []   # Created order of Model field object
 history = None          #: Returns history of SQL execution. You can get history like a list (index:0 is latest).
 SQL_TRACE_OUT = None    # In case of tracing SQL and parameters on CursorWrapper, set output stream(ex. sys.stderr)
 sqlite_version_info = sqlite3.sqlite_version_info
+FETCH_SIZE = 256        # Count of rows fetched at once by QuerySet
+STATEMENT_CACHE_SIZE = 512  # Count of prepared statements cached by sqlite3 per connection
+_now = datetime.now     # Clock for AtCreate and AtSave fields, which can be replaced in tests
+
+# PRAGMAs for in-memory databases, which have no file to be synchronized.
+MEMORY_DB_PRAGMAS = ("journal_mode = MEMORY", "synchronous = OFF", "temp_store = MEMORY")
+
+_select_cache = {}      # Compiled lookups of QuerySet.select(), see _compile_lookup()
+_join_path_cache = {}   # Resolved relation paths, see _resolve_path()
+_where_cache = {}       # Compiled keywords of QuerySet.select() per shape, see _compile_where()
+_join_template_cache = {}   # JOIN clause templates per RelEdge, see RelEdge.join()
+_get_sql_cache = {}     # SELECT statements of Model.get() with keywords, see Model._get_by_keywords()
+_SELECT_CACHE_SIZE = 512
+_regexp_cache = {}      # Compiled patterns for REGEXP function, see _regexp()
+_re2_regexp_cache = {}  # Compiled patterns for re2_regexp()
+_REGEXP_CACHE_SIZE = 256
+_table_info_cache = {}  # Results of PRAGMA table_info() per CREATE TABLE statement
+_get_cache = weakref.WeakValueDictionary()  # Objects returned by Model.get() of models with _cache_get
+_PLACEHOLDERS = tuple([",".join(["?"] * i) for i in range(64)])    # "?,?,?" per count of values
+# Longer lists for IN are passed as a JSON parameter, see _use_json_each()
+_JSON_EACH = sqlite_version_info >= (3, 38, 0)  # JSON functions are built in by default
+_JSON_TYPES = (str, int, float) if PY3K else (str, unicode, int, long, float)
+
+# Compiled regular expressions
+_CHAR_LENGTH_RE = re.compile(r"CHAR\s*\((\d+)\)", re.I)  # length of CHAR type
+_ORDER_FIELD_RE = re.compile(r"(\w+)\.(\w+)")            # 'table.field' in order_by()
 
 #_callbacks_when_connect = [] # TEMPORARY BUG FIX: see the comment of ModelMeta.__init__()
 
 # --- Module methods
-def macaronage(dbfile=":memory:", lazy=False, autocommit=False, logger=None, history=-1, keep=False, threading=False, regexp=None):
+def macaronage(dbfile=":memory:", lazy=False, autocommit=False, logger=None, history=-1, keep=False, threading=False, regexp=None, pragmas=None):
     """
     :param dbfile: SQLite database file name.
     :param lazy: Uses :class:`LazyConnection`.
     :param autocommit: Commits automatically when closing database.
     :param logger: Uses for logging SQL execution.
+                   Default: ``logging.getLogger("macaron.sql")`` if ``history`` is enabled
     :param history: Sets max count of SQL execution history (0 is unlimited, -1 is disabled).
                     Default: disabled
     :param keep: keep previous object and connection (EXPERIMENTAL)
+    :param regexp: REGEXP function which takes the pattern and the value.
+                   Default: uses :mod:`re`, see also :func:`re2_regexp`
+    :param pragmas: PRAGMA statements like ``"cache_size = -20000"``, which are executed on connecting.
+                    Default: :data:`MEMORY_DB_PRAGMAS` for ``":memory:"``, none for database files
     :type logger: :class:`logging.Logger`
 
     Initializes macaron.
@@ -80,13 +125,16 @@ def macaronage(dbfile=":memory:", lazy=False, autocommit=False, logger=None, his
     will connect to the DB when using. If ``autocommit`` is ``True``, this will commits
     when this object will be unloaded.
     """
+    if regexp is re2_regexp and re2 is None: raise ImportError("re2_regexp requires google-re2.")
     if keep and globals()["_m"]: return
+    _get_cache.clear()
     globals()["_m"] = Macaron()
-    globals()["history"] = ListHandler(-1)
+    prev_history, globals()["history"] = globals()["history"], ListHandler(-1)
     conn = None
     if history >= 0: # enable history logger
-        logger = logger or logging.getLogger()
+        logger = logger or logging.getLogger("macaron.sql")
         logger.setLevel(logging.DEBUG)
+        if prev_history: logger.removeHandler(prev_history)  # not to accumulate handlers
         globals()["history"].set_max_count(history)
         logger.addHandler(globals()["history"])
     # To avoid sqlite3.ProgrammingError in checking same thread, specify 'check_same_thread' False.
@@ -96,20 +144,17 @@ def macaronage(dbfile=":memory:", lazy=False, autocommit=False, logger=None, his
     #   id -1221678384' in <bound method Macaron.__del__ of <macaron.Macaron object at 0xb4a93eec>> ignored
     # But this is NOT a fundamental solution...Maybe.
     # About threadsafety of sqlite3: http://www.sqlite.org/threadsafe.html
-    if lazy: conn = LazyConnection(dbfile, factory=_create_wrapper(logger), check_same_thread=(not threading))
-    else: conn = sqlite3.connect(dbfile, factory=_create_wrapper(logger), check_same_thread=(not threading))
+    if pragmas is None: pragmas = MEMORY_DB_PRAGMAS if dbfile == ":memory:" else ()
+    factory = _create_wrapper(logger, pragmas)
+    kw = {"factory": factory, "check_same_thread": not threading, "cached_statements": STATEMENT_CACHE_SIZE}
+    if lazy: conn = LazyConnection(dbfile, **kw)
+    else: conn = sqlite3.connect(dbfile, **kw)
     if not conn: raise Exception("Can't create connection.")
 
     # Set REGEXP function
-    if regexp is None:
-        def _regexp(expr, item):
-            try: return re.search(expr, item) is not None
-            except Exception as e: raise
-    elif callable(regexp):
-        _regexp = regexp
-    else:
-        raise ValueError("regexp must be 'default' or function.")
-    conn.create_function("REGEXP", 2, _regexp)
+    if regexp is None: regexp = _regexp
+    elif not callable(regexp): raise ValueError("regexp must be 'default' or function.")
+    conn.create_function("REGEXP", 2, regexp)
 
     _m.connection["default"] = conn
     _m.autocommit = autocommit
@@ -120,34 +165,88 @@ def macaronage(dbfile=":memory:", lazy=False, autocommit=False, logger=None, his
 #        try: callback()
 #        except: pass
 
+def _regexp(expr, item):
+    """Default REGEXP function. This is called for each row, so compiled patterns are cached."""
+    return _cached_search(_regexp_cache, expr, re.compile)(item) is not None
+
+def re2_regexp(expr, item):
+    """REGEXP function by google-re2, which matches without backtracking.
+    This is used by ``macaronage(regexp=macaron.re2_regexp)``. Note that RE2 differs from
+    :mod:`re` in some points, ex. ``\\w`` matches ASCII characters only.
+    Patterns not supported by RE2 like backreferences are compiled by :mod:`re`."""
+    return _cached_search(_re2_regexp_cache, expr, _compile_re2)(item) is not None
+
+def _compile_re2(expr):
+    try: return re2.compile(expr, _RE2_OPTIONS)
+    except re2.error: return re.compile(expr)
+
+def _cached_search(cache, expr, compile):
+    try: return cache[expr]
+    except KeyError:
+        if len(cache) >= _REGEXP_CACHE_SIZE: cache.clear()
+        search = cache[expr] = compile(expr).search
+        return search
+
 def execute(*args, **kw):
-    """Wrapper for ``Cursor#execute()``."""
+    """Wrapper for ``Cursor#execute()``.
+    The SQL is passed to the cursor as it is, so it must be a single statement."""
     return _m.connection["default"].cursor().execute(*args, **kw)
 
 def bake():     _m.connection["default"].commit()   # Commits
-def rollback(): _m.connection["default"].rollback() # Rollback
+def rollback():
+    """Rollback"""
+    _get_cache.clear()
+    _m.connection["default"].rollback()
 def cleanup():
     """Closes database and tidies up the Macaron object"""
     _m.connection["default"].close()
     globals()["_m"] = None
 
+def clear_select_cache():
+    """Clears compiled lookups of :meth:`QuerySet.select`.
+    This is needed when field or table definitions of models are changed."""
+    _select_cache.clear()
+    _join_path_cache.clear()
+    _where_cache.clear()
+    _join_template_cache.clear()
+    _get_sql_cache.clear()
+
 def create_table(cls, cascade=False, link_tables=True):
     """Create table from Model class"""
     if not issubclass(cls, Model): raise TypeError("The first arg must be Model class, not '%s'." % cls.__name__)
 
-    # Check if table exists.
-    table_name = cls.__dict__["_meta"].table_name
-    cur = execute("SELECT * FROM sqlite_master WHERE type = 'table' AND name = ?", [table_name])
-    if cur.fetchall():
-        raise cls.TableAlreadyExists("Table '%s' already exists in database." % cls._meta.table_name)
+    table_name = cls._meta.table_name   # This also sets up TableMetaInfo of the class.
+
+    # CREATE TABLE clause is determined by the model definition,
+    # so it is generated once and kept in the class property.
+    cprop = cls.__dict__["_meta"]
+    if not cprop.ddl_sql:
+        cprop.ddl_sql = _create_table_sql(cls, cascade)
+        clear_select_cache()    # field names of ManyToOne are set in generating
+
+    # Check if table exists, only when CREATE TABLE fails. The error is expected for the existing table,
+    # so the DDL is executed without the tracing of CursorWrapper and traced after that.
+    cur = _m.connection["default"].cursor()
+    try: sqlite3.Cursor.execute(cur, cprop.ddl_sql)
+    except sqlite3.OperationalError:
+        if execute("SELECT * FROM sqlite_master WHERE type = 'table' AND name = ?", [table_name]).fetchall():
+            raise cls.TableAlreadyExists("Table '%s' already exists in database." % table_name)
+        cur._trace_error(cprop.ddl_sql, [])
+        raise
+    cur._trace(cprop.ddl_sql, [])
+    _m.connection["default"].cache_table_info(table_name, warn=False, ddl_sql=cprop.ddl_sql)
 
+    if link_tables:
+        create_link_tables(cls)
+
+def _create_table_sql(cls, cascade):
+    """Generates CREATE TABLE clause of Model class"""
     # Process Field and ManyToOne objects, which are defined by user
-    cdic = cls.__dict__ # for direct access to property objects
     field_order = {}
     has_primary_key = False
     # 2021-05-29: ManyToOne to self object causes 'RuntimeError: dictionary changed size during iteration'
     # To avoid it, list the iteration before loop.
-    for k, fld in list(filter(lambda x: isinstance(x[1], Field), cdic.items())):
+    for k, fld in list(cls._fields.items()):
         if not fld.is_user_defined: continue
         if isinstance(fld, ManyToOne):
             meta = None
@@ -159,12 +258,12 @@ def create_table(cls, cascade=False, link_tables=True):
                     else: create_table(fld.ref)
             # Generate REFERENCES clause
             refkey = fld.ref_key or meta.primary_key.name
-            sql  = 'REFERENCES "%s"("%s")' % (meta.table_name, refkey)
-            if fld.on_delete: sql += " ON DELETE %s" % fld.on_delete
-            if fld.on_update: sql += " ON UPDATE %s" % fld.on_update
+            refs = ['REFERENCES "%s"("%s")' % (meta.table_name, refkey)]
+            if fld.on_delete: refs.append("ON DELETE %s" % fld.on_delete)
+            if fld.on_update: refs.append("ON UPDATE %s" % fld.on_update)
             fld.name = fld.fkey or "%s_id" % meta.table_name
             fld.type = meta.fields[refkey].type
-            fld.extra_sql = sql
+            fld.extra_sql = " ".join(refs)
         else:
             fld.name = k
             if fld.is_primary_key: has_primary_key = True
@@ -172,27 +271,56 @@ def create_table(cls, cascade=False, link_tables=True):
 
     # Create primary key field if not exists
     field_clauses = []
-    if not has_primary_key:
-        fld = IntegerField(primary_key=True)
-        fld.name = "id"
-        field_clauses.append(fld.field_clause())
+    if not has_primary_key: field_clauses.append(_SERIAL_KEY.field_clause())
 
-    # Generate CREATE TABLE clause and execute
+    # Generate CREATE TABLE clause
     for k in sorted(field_order.keys()): field_clauses.append(field_order[k].field_clause())
-    sql  = 'CREATE TABLE "%s" (\n  %s' % (cdic["_meta"].table_name, ",\n  ".join(field_clauses))
-    if cdic["_meta"].unique_together: sql += ',\n  UNIQUE ("%s")' % '", "'.join(cdic["_meta"].unique_together)
-    sql += "\n)"
-    execute(sql)
-    _m.connection["default"].cache_table_info(cdic["_meta"].table_name, warn=False)
+    cprop = cls.__dict__["_meta"]
+    if cprop.unique_together: field_clauses.append('UNIQUE ("%s")' % '", "'.join(cprop.unique_together))
+    return 'CREATE TABLE "%s" (\n  %s\n)' % (cprop.table_name, ",\n  ".join(field_clauses))
 
-    if link_tables:
-        create_link_tables(cls)
+def create_tables(*models, **kw):
+    """Creates tables of Model classes in a single transaction.
+    Keyword arguments are passed to :func:`create_table`."""
+    with transaction("IMMEDIATE"):
+        for cls in models: create_table(cls, **kw)
+
+@contextlib.contextmanager
+def transaction(mode="DEFERRED"):
+    """Runs the ``with`` block in a transaction, which is committed at the end of the block
+    or rolled back by an exception. In a transaction already begun, the block joins it
+    and the transaction is left to the caller.
+
+    On Python 2, a transaction begun implicitly by :mod:`sqlite3` is committed at first.
+
+    :param mode: ``"DEFERRED"``, ``"IMMEDIATE"`` or ``"EXCLUSIVE"``
+    """
+    conn = _m.connection["default"]
+    if _m.in_transaction or getattr(conn, "in_transaction", False):
+        yield
+        return
+    # sqlite3 module of Python 2 commits before DDL implicitly, which breaks the transaction.
+    # So the module is kept from handling transactions and BEGIN/COMMIT are issued here.
+    level = conn.isolation_level        # This also opens LazyConnection.
+    conn = getattr(conn, "_conn", conn) # The real connection of LazyConnection
+    conn.isolation_level = None
+    _m.in_transaction = True
+    try:
+        execute("BEGIN %s" % mode)
+        try: yield
+        except:
+            _get_cache.clear()
+            execute("ROLLBACK")
+            raise
+        execute("COMMIT")
+    finally:
+        _m.in_transaction = False
+        conn.isolation_level = level
 
 def create_link_tables(cls):
-    cdic = cls.__dict__ # for direct access to property objects
     # Avoid for RuntimeError: dictionary changed size during iteration,
-    # convert cdic.items() to list
-    for k, fld in filter(lambda x: isinstance(x[1], ManyToMany), list(cdic.items())):
+    # convert items() to list
+    for k, fld in filter(lambda x: isinstance(x[1], ManyToMany), list(cls._relations.items())):
         create_table(fld.lnk)
 
 # --- Classes
@@ -203,6 +331,7 @@ class Macaron(object):
         self.connection = {}
         self.used_by = []
         self.sql_logger = None
+        self.in_transaction = False # True in the block of transaction()
 
     def __del__(self):
         """Closing the connections"""
@@ -224,31 +353,38 @@ class Macaron(object):
         return self.connection[meta_obj.conn_name]
 
 # --- Connection wrappers
-def _create_wrapper(logger):
+def _create_wrapper(logger, pragmas=()):
     """Returns ConnectionWrapper class"""
     class ConnectionWrapper(sqlite3.Connection):
         def __init__(self, *args, **kw):
             super(ConnectionWrapper, self).__init__(*args, **kw)
             self.execute("PRAGMA foreign_keys = ON")    # fkey support ON (SQLite>=3.6.19)
+            for pragma in pragmas: self.execute("PRAGMA %s" % pragma)
             self.warn_pragma = True
 
             # Cache results of PRAGMA table_info() for TRANSACTION
             self.table_info = {}
-            cur = self.execute("SELECT * FROM sqlite_master WHERE type = 'table'")
-            for rec in cur:
-                self.cache_table_info(rec[2], warn=False)
+            cur = self.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table'")
+            for rec in cur.fetchall():
+                self.cache_table_info(rec[0], warn=False, ddl_sql=rec[1])
 
         def cursor(self):
             self.logger = logger
             return super(ConnectionWrapper, self).cursor(CursorWrapper)
 
-        def cache_table_info(self, table_name, warn=True):
+        def cache_table_info(self, table_name, warn=True, ddl_sql=None):
+            # Tables created by the same statement have the same columns,
+            # so the PRAGMA is skipped for the known CREATE TABLE statement.
+            if ddl_sql in _table_info_cache:
+                self.table_info[table_name] = _table_info_cache[ddl_sql]
+                return self.table_info[table_name][:]
             if self.warn_pragma and warn:
                 raise UserWarning("Execution of PRAGMA table_info(%s) will break TRANSACTION." % table_name)
 #            else:
 #                print 'PRAGMA table_info("%s")' % table_name
             cur = self.execute('PRAGMA table_info("%s")' % table_name)
             self.table_info[table_name] = cur.fetchall()
+            if ddl_sql: _table_info_cache[ddl_sql] = self.table_info[table_name]
             return self.table_info[table_name][:]
 
         def get_table_info(self, table_name):
@@ -260,20 +396,36 @@ def _create_wrapper(logger):
 class CursorWrapper(sqlite3.Cursor):
     """Subclass of sqlite3.Cursor for logging"""
     def execute(self, sql, parameters=[]):
+        self._trace(sql, parameters)
+        try:
+            return super(CursorWrapper, self).execute(sql, parameters)
+        except:
+            self._trace_error(sql, parameters)
+            raise
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)    # for logging
+        self._trace(sql, seq_of_parameters)
+        try:
+            return super(CursorWrapper, self).executemany(sql, seq_of_parameters)
+        except:
+            self._trace_error(sql, seq_of_parameters)
+            raise
+
+    def _trace(self, sql, parameters):
         if self.connection.logger:
-            self.connection.logger.debug("%s\nparams: %s" % (sql, str(parameters)))
+            # The message is formatted only when it is emitted or read from the history.
+            self.connection.logger.debug("%s\nparams: %s", sql, parameters)
         if(isinstance(history, ListHandler)):
             history.lastsql = sql
             history.lastparams = parameters
         if SQL_TRACE_OUT:
             SQL_TRACE_OUT.write("[macaron:SQL  ]:%s\n" % sql)
             SQL_TRACE_OUT.write("[macaron:PARAM]:%s\n" % str(parameters))
-        try:
-            return super(CursorWrapper, self).execute(sql, parameters)
-        except:
-            sys.stderr.write("[macaron:Error in SQL  ]\n%s\n" % sql)
-            sys.stderr.write("[macaron:Error in PARAM]\n%s\n" % str(parameters))
-            raise
+
+    def _trace_error(self, sql, parameters):
+        sys.stderr.write("[macaron:Error in SQL  ]\n%s\n" % sql)
+        sys.stderr.write("[macaron:Error in PARAM]\n%s\n" % str(parameters))
 
 class LazyConnection(object):
     """Lazy connection wrapper"""
@@ -296,11 +448,22 @@ class ListHandler(logging.Handler):
        :param max_count: max count of SQL history (0 is unlimited, -1 is disabled)
     """
     class _SQLParamTracer(object):
-        def __init__(self, msg):
-            m = re.match(r"(?P<sql>.+)\nparams: (?P<params>.+)", msg, re.MULTILINE + re.DOTALL)
-            if not m: raise RuntimeError("Invalid message format. '%s'" % msg)
-            self.sql = m.group("sql")
-            self.param_str = m.group("params")
+        def __init__(self, record):
+            # Records from CursorWrapper have (sql, parameters) as the arguments,
+            # which are formatted when the history is read.
+            if record.msg == "%s\nparams: %s" and len(record.args) == 2:
+                self.sql, self.params = record.args
+                return
+            # This is called on every SQL execution, so split without regular expression.
+            msg = record.getMessage()
+            sql, sep, param_str = msg.rpartition("\nparams: ")
+            if not (sql and param_str): raise RuntimeError("Invalid message format. '%s'" % msg)
+            self.sql = sql
+            self._param_str = param_str
+        def _get_param_str(self):
+            try: return self._param_str
+            except AttributeError: return str(self.params)
+        param_str = property(_get_param_str)
         def __str__(self): return "%s\nparams: %s" % (self.sql, self.param_str)
         def __unicode__(self): return u"%s\nparams: %s" % (self.sql, self.param_str)
 
@@ -309,25 +472,25 @@ class ListHandler(logging.Handler):
         self.lastsql = None
         self.lastparams = None
         self._max_count = max_count
-        self._list = []
+        self._list = collections.deque(maxlen=max_count if max_count > 0 else None)   # index:0 is latest
 
     def emit(self, record):
-        if self._max_count < 0: return
-        if self._max_count > 0:
-            while len(self._list) >= self._max_count: self._list.pop()
-        self._list.insert(0, self._SQLParamTracer(record.getMessage()))
+        if not self.enabled: return
+        self._list.appendleft(self._SQLParamTracer(record))    # the oldest is dropped
 
     def _get_max_count(self): return self._max_count
 
     def set_max_count(self, max_count):
         self._max_count = max_count
-        if max_count > 0:
-            while len(self._list) > self._max_count: self._list.pop()
+        if max_count > 0: self._list = collections.deque(list(self._list)[:max_count], max_count)
+        else: self._list = collections.deque(self._list)
     max_count = property(_get_max_count)
+    def _is_enabled(self): return self._max_count >= 0
+    enabled = property(_is_enabled)     #: False if the history is disabled
 
     def count(self): return len(self._list)
     def __getitem__(self, idx):
-        if self._max_count < 0:
+        if not self.enabled:
             raise RuntimeError("SQL history is disabled. Use macaronage() with 'history' parameter.")
         if len(self._list) <= idx: raise IndexError("SQL history max_count is %d." % len(self._list))
         return self._list.__getitem__(idx)
@@ -371,7 +534,7 @@ class FieldFactory(object):
                     use_field_class = fldcls
                     break
             fld = use_field_class(**fldkw)
-        fld.cid, fld.name, fld.type = row[0:3]
+        fld.cid, fld.name, fld.type = row[0], _intern(row[1]), row[2]
         fld.initialize_after_meta()
         # convert default from 'PRAGMA table_info()'.
         if fld.default == None and rec["default"] != None:
@@ -386,6 +549,7 @@ class TableMetaClassProperty(property):
         self.table_meta = None
         self.table_name = None
         self.conn_name = "default"  #: for future use. multiple databases?
+        self.ddl_sql = None         #: CREATE TABLE clause, which is set by create_table()
 
     def __get__(self, owner_obj, cls):
         if not self.table_meta:
@@ -422,7 +586,7 @@ class TableMetaInfo(object):
                 # ex. author ManyToOne field corresponds to author_id IntegerField.
                 if fld.fkey not in cls.__dict__:
                     reffld = None
-                    for f in filter(lambda v:isinstance(v, Field), fld.ref.__dict__.values()):
+                    for f in fld.ref._fields.values():
                         if f.is_primary_key: reffld = f
                     if isinstance(reffld, IntegerField): fkey = IntegerField(null=fld.null)
                     assert fkey, "Foreign key must be Integer"
@@ -437,6 +601,27 @@ class TableMetaInfo(object):
             else:
                 self.fields.append(fld)
             if fld.is_primary_key: self.primary_key = fld
+        self._fields_of = {}    # field class -> list of fields, see fields_of()
+        self._cls = cls
+        self._hydrators = {}    # column names -> generated function, see hydrator()
+        self._last_hydrator = (None, None)  # (cursor description, function) used last
+
+        # Quoted identifiers, which are shared by generated SQL
+        self.quoted_name = '"%s"' % table_name                                  #: ex. '"member"'
+        self.quoted_columns = dict([(fld.name, '%s."%s"' % (self.quoted_name, fld.name))
+                                    for fld in self.fields])                    #: ex. {'id': '"member"."id"'}
+
+        # SQL templates for Model. INSERT depends on the columns given, see insert_sql().
+        names = [fld.name for fld in self.fields]
+        #: Returns values of all fields from Model._data as a tuple, in the order of the fields
+        self.values_of = operator.itemgetter(*names) if len(names) > 1 else lambda d: (d[names[0]],)
+        #: Default values of all fields, which are copied to Model._data of a new object
+        self.defaults = dict([(fld.name, fld.default) for fld in self.fields])
+        self._insert_sql = {}
+        self.update_sql = 'UPDATE %s SET %s WHERE "%s" = ?' \
+            % (self.quoted_name, ", ".join(['"%s" = ?' % n for n in names]), self.primary_key.name)
+        self.delete_sql = 'DELETE FROM %s WHERE "%s" = ?' % (self.quoted_name, self.primary_key.name)
+        self.get_sql = 'SELECT * FROM %s WHERE "%s" = ?' % (self.quoted_name, self.primary_key.name)
 
 #        cur = conn.cursor()
 #        rows = conn.get_table_info(table_name)
@@ -446,6 +631,59 @@ class TableMetaInfo(object):
 #            self.fields.append(fld)
 #            if fld.is_primary_key: self.primary_key = fld
 
+    def fields_of(self, fld_cls):
+        """Returns fields which are instances of *fld_cls* (cached per class)."""
+        try: return self._fields_of[fld_cls]
+        except KeyError:
+            flds = self._fields_of[fld_cls] = [fld for fld in self.fields if isinstance(fld, fld_cls)]
+            return flds
+
+    def insert_sql(self, names):
+        """Returns INSERT statement for the column *names* (cached per columns)."""
+        names = tuple(names)
+        try: return self._insert_sql[names]
+        except KeyError:
+            holder = ", ".join(["?"] * len(names))
+            sql = self._insert_sql[names] = 'INSERT INTO %s ("%s") VALUES (%s)' % (self.quoted_name, '", "'.join(names), holder)
+            return sql
+
+    def hydrator(self, description):
+        """Returns the function converting a row of the cursor to a model object.
+        The function is generated for the columns of the *description* and cached.
+        """
+        # The description is the same object while a cursor is used,
+        # so rows from the same cursor skip the lookup by column names.
+        if description is self._last_hydrator[0]: return self._last_hydrator[1]
+        columns = tuple([d[0] for d in description])
+        if columns in self._hydrators:
+            self._last_hydrator = (description, self._hydrators[columns])
+            return self._hydrators[columns]
+
+        # Values of plain fields are stored as they are. Others are converted
+        # by Field.to_object() and Field.cast(), which may use the sqlite3.Row.
+        # Cursors return tuples, so the Row is built only for such fields.
+        ns = {"new": self._cls.__new__, "cls": self._cls, "Row": sqlite3.Row}
+        items = []
+        use_row = False
+        for i, fld in enumerate(self.fields):
+            value = "row[%d]" % columns.index(fld.name)
+            if type(fld).to_object != Field.to_object:
+                value, use_row = "to_object%d(rec, %s)" % (i, value), True
+                ns["to_object%d" % i] = fld.to_object
+            if type(fld).cast != Field.cast:
+                value = "cast%d(%s)" % (i, value)
+                ns["cast%d" % i] = fld.cast
+            items.append("%r: %s" % (fld.name, value))
+        src  = ["def hydrate(cur, row):", "    obj = new(cls)"]
+        if use_row: src.append("    rec = row if type(row) is Row else Row(cur, row)")
+        src.append("    obj._data = {%s}" % ", ".join(items))
+        src.append("    obj._orig_pk = obj._data[%r]" % self.primary_key.name)
+        src.append("    return obj")
+        exec(compile("\n".join(src), "<hydrate %s>" % self.table_name, "exec"), ns)
+        func = self._hydrators[columns] = ns["hydrate"]
+        self._last_hydrator = (description, func)
+        return func
+
 # --- Field converting and validation
 class Field(property):
     SQL_TYPE = "UNKNOWN"
@@ -457,6 +695,7 @@ class Field(property):
         self.null, self.default, self.unique = null, default, unique
         self.is_primary_key = primary_key
         self.extra_sql = extra_sql
+        self._field_clause = None   # (key, clause) cache for field_clause()
         _pre_field_order.append(self)
 
     def cast(self, value): return value
@@ -476,6 +715,14 @@ class Field(property):
         owner_obj._data[self.name] = self.cast(value)
 
     def field_clause(self):
+        # The clause is generated in each create_table(), so cache it with the attributes
+        # which construct it. The key is compared by equality, a default value may be unhashable.
+        key = (self.name, self.type, self.is_primary_key, self.null, self.unique, self.default, self.extra_sql)
+        if self._field_clause and self._field_clause[0] == key: return self._field_clause[1]
+        self._field_clause = (key, self._generate_field_clause())
+        return self._field_clause[1]
+
+    def _generate_field_clause(self):
         if self.type == Field.SQL_TYPE:
             warnings.warn("'%s'.type is '%s'." % (self.__class__.__name__, Field.SQL_TYPE))
         a = ['"%s"' % self.name, self.type]
@@ -495,6 +742,15 @@ class Field(property):
 class AtCreate(Field): pass
 class AtSave(Field): pass
 
+# Parsers for values of TimestampField, DateField and TimeField.
+# fromisoformat() (Python>=3.7) is implemented in C and much faster than strptime().
+if hasattr(datetime, "fromisoformat"):
+    _parse_timestamp, _parse_date, _parse_time = datetime.fromisoformat, date.fromisoformat, time.fromisoformat
+else:
+    def _parse_timestamp(value): return datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+    def _parse_date(value): return datetime.strptime(value, "%Y-%m-%d").date()
+    def _parse_time(value): return datetime.strptime(value, "%H:%M:%S").time()
+
 class TimestampField(Field):
     TYPE_NAMES = (r"^TIMESTAMP$", r"^DATETIME$")
     SQL_TYPE = "TIMESTAMP"
@@ -503,7 +759,7 @@ class TimestampField(Field):
         return value.strftime("%Y-%m-%d %H:%M:%S")
     def to_object(self, row, value):
         if value is None: return None
-        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+        return _parse_timestamp(value)
 
 class DateField(Field):
     TYPE_NAMES = (r"^DATE$",)
@@ -513,7 +769,7 @@ class DateField(Field):
         return value.strftime("%Y-%m-%d")
     def to_object(self, row, value):
         if value is None: return None
-        return datetime.strptime(value, "%Y-%m-%d").date()
+        return _parse_date(value)
 
 class TimeField(Field):
     TYPE_NAMES = (r"^TIME$",)
@@ -523,25 +779,25 @@ class TimeField(Field):
         return value.strftime("%H:%M:%S")
     def to_object(self, row, value):
         if value is None: return None
-        return datetime.strptime(value, "%H:%M:%S").time()
+        return _parse_time(value)
 
 class TimestampAtCreate(TimestampField, AtCreate):
     def __init__(self, **kw):
         kw["null"] = True
         super(TimestampAtCreate, self).__init__(**kw)
-    def set(self, obj, value): return datetime.now()
+    def set(self, obj, value): return _now()
 
 class DateAtCreate(DateField, AtCreate):
     def __init__(self, **kw):
         kw["null"] = True
         super(DateAtCreate, self).__init__(**kw)
-    def set(self, obj, value): return datetime.now().date()
+    def set(self, obj, value): return _now().date()
 
 class TimeAtCreate(TimeField, AtCreate):
     def __init__(self, **kw):
         kw["null"] = True
         super(TimeAtCreate, self).__init__(**kw)
-    def set(self, obj, value): return datetime.now().time()
+    def set(self, obj, value): return _now().time()
 
 class TimestampAtSave(TimestampAtCreate, AtSave): pass
 class DateAtSave(DateAtCreate, AtSave): pass
@@ -551,6 +807,7 @@ class FloatField(Field):
     TYPE_NAMES = ("REAL", "FLOA", "DOUB")
     SQL_TYPE = "FLOAT"
     VALUE_TYPE = "NUM"
+    VALUE_NAME = "a number"     # for the message of ValidationError
 
     def __init__(self, max=None, min=None, **kw):
         super(FloatField, self).__init__(**kw)
@@ -566,7 +823,7 @@ class FloatField(Field):
         if value == None: return True
         try: self.cast(value)
         except (ValueError, TypeError):
-            raise ValidationError("Field '%s': Value must be a number, not '%s' [%s]." % (self.name, type(value).__name__, value))
+            raise ValidationError("Field '%s': Value must be %s, not '%s' [%s]." % (self.name, self.VALUE_NAME, type(value).__name__, value))
         if self.max != None and value > self.max:
             raise ValidationError("Field '%s': Max value is exceeded. [%d]" % (self.name, value))
         if self.min != None and value < self.min:
@@ -576,21 +833,20 @@ class FloatField(Field):
 class IntegerField(FloatField):
     TYPE_NAMES = ("INT",)
     SQL_TYPE = "INTEGER"
+    VALUE_NAME = "an integer"
 
 #    def initialize_after_meta(self):
 #        if re.match(r"^INTEGER$", self.type, re.I) and self.is_primary_key: self.null = True
 
+    # FloatField.validate() checks the value with this cast() and the range at once.
     def cast(self, value):
         if value == None: return None
         return int(value)
 
-    def validate(self, obj, value):
-        super(IntegerField, self).validate(obj, value)
-        if value == None: return True
-        try: self.cast(value)
-        except (ValueError, TypeError):
-            raise ValidationError("Field '%s': Value must be an integer, not '%s' [%s]." % (type(value).__name__, value))
-        return True
+# Primary key field for create_table() when the table does not have it.
+# This is shared for reusing the field clause (and not to grow _pre_field_order).
+_SERIAL_KEY = IntegerField(primary_key=True)
+_SERIAL_KEY.name = "id"
 
 class SerialKeyField(IntegerField):
     def __init__(self, primary_key=True, null=True, **kw):
@@ -614,7 +870,7 @@ class CharField(Field):
     type = property(_get_sql_type, _set_sql_type)
 
     def initialize_after_meta(self):
-        m = re.search(r"CHAR\s*\((\d+)\)", self.type, re.I)
+        m = _CHAR_LENGTH_RE.search(self.type)
         if m and (not self.max_length or self.max_length > int(m.group(1))):
             self.max_length = int(m.group(1))
 
@@ -631,11 +887,12 @@ class MatchingField(CharField):
     def __init__(self, pattern, **kw):
         super(MatchingField, self).__init__(**kw)
         self.pattern = pattern
+        self._match = re.compile(pattern).match    # compiled once, validated on every assignment
 
     def validate(self, obj, value):
         super(MatchingField, self).validate(obj, value)
         if value == None: return True
-        if not re.match(self.pattern, value):
+        if not self._match(value):
             raise ValidationError("Field '%s': Text does not match patern." % self.name)
         return True
 
@@ -651,9 +908,11 @@ class ManyToOne(Field):
         self.related_name = related_name    #: accessor name for one to many relation
         self.on_delete = on_delete
         self.on_update = on_update
+        self._select_sql = None             # SQL for the referenced object, see __get__()
         _pre_field_order.append(self)
 
-    def set_query(self, query_set, tblname, name):
+    def join_clauses(self, tblname, name):
+        """Returns JOIN clauses for the relation, the related model and its alias."""
         h = {
             "reftbl": self.ref._meta.table_name,
             "refkey": self.ref_key,
@@ -662,8 +921,7 @@ class ManyToOne(Field):
             "fldname": "%s.%s" % (tblname, name)
         }
         tmpl = 'INNER JOIN "%(reftbl)s" AS "%(fldname)s" ON "%(clstbl)s"."%(clskey)s" = "%(fldname)s"."%(refkey)s"'
-        query_set.clauses["joins"].append(tmpl % h)
-        return self.ref, h["fldname"]
+        return [tmpl % h], self.ref, h["fldname"]
 
     def _get_ref_key(self):
         self._ref_key = self._ref_key or self.ref._meta.primary_key.name
@@ -672,18 +930,19 @@ class ManyToOne(Field):
     ref_key = property(_get_ref_key)
 
     def __get__(self, owner, cls):
-        if getattr(owner, self.fkey) is None: return None
-        reftbl = self.ref._meta.table_name
-        clstbl = cls._meta.table_name
+        value = owner._data.get(self.fkey)  # value of the foreign key field
+        if value is None: return None
 #        sql = 'SELECT "%s".* FROM "%s" LEFT JOIN "%s" ON "%s" = "%s"."%s" WHERE "%s"."%s" = ?' \
 #            % (reftbl, clstbl, reftbl, self.fkey, reftbl, self.ref_key, \
 #               clstbl, cls._meta.primary_key.name)
-        sql = 'SELECT * FROM "%s" WHERE "%s" = ?' % (reftbl, self.ref_key)
+        if not self._select_sql:
+            self._select_sql = 'SELECT * FROM %s WHERE "%s" = ?' % (self.ref._meta.quoted_name, self.ref_key)
         cur = cls._meta._conn.cursor()
 #        cur = cur.execute(sql, [owner.pk])
-        cur = cur.execute(sql, [getattr(owner, self.fkey)])
+        cur = cur.execute(self._select_sql, [value])
         row = cur.fetchone()
-        if cur.fetchone(): raise NotUniqueForeignKey("Reference key '%s.%s' is not unique." % (reftbl, self.ref_key))
+        if cur.fetchone():
+            raise NotUniqueForeignKey("Reference key '%s.%s' is not unique." % (self.ref._meta.table_name, self.ref_key))
         return self.ref._factory(cur, row)
 
     def __set__(self, owner, value):
@@ -708,7 +967,7 @@ class ManyToOne(Field):
             self.ref = getattr(sys.modules[rev_cls.__module__], self.ref)
 
         self.name = fld_name    # set field name
-        if not self.fkey: self.fkey = "%s_id" % self.name
+        if not self.fkey: self.fkey = _intern("%s_id" % self.name)
         assert self.name, "ManyToOne#name couldn't be specified."
         assert self.fkey, "ManyToOne#fkey couldn't be specified."
         self.related_name = self.related_name or "%s_set" % rev_cls.__name__.lower()
@@ -717,6 +976,7 @@ class ManyToOne(Field):
 
 class _ManyToOne_Rev(property):
     """The reverse of many-to-one relationship (i.e. 'one' side)."""
+    __slots__ = ("ref", "_ref_key", "rev", "rev_fkey")
     def __init__(self, ref, ref_key, rev, rev_fkey):
         self.ref = ref              # Reference table (parent)
         self._ref_key = ref_key     # Key column name of parent
@@ -724,7 +984,7 @@ class _ManyToOne_Rev(property):
         self.rev_fkey = rev_fkey    # Foreign key name of child
         assert self.rev_fkey, "Foreign key was not specified in ManyToOne#_called_in_modelmeta_init"
 
-    def set_query(self, query_set, tblname, name):
+    def join_clauses(self, tblname, name):
         # Generate INNER JOIN-ed clause
         h = {
             "revtbl": self.rev._meta.table_name,
@@ -734,8 +994,7 @@ class _ManyToOne_Rev(property):
             "fldname": "%s.%s" % (tblname, name),
         }
         tmpl = 'INNER JOIN "%(revtbl)s" AS "%(fldname)s" ON "%(reftbl)s"."%(refkey)s" = "%(fldname)s"."%(revkey)s"'
-        query_set.clauses["joins"].append(tmpl % h)
-        return self.rev, h["fldname"]
+        return [tmpl % h], self.rev, h["fldname"]
 
     def _get_ref_key(self):
         self._ref_key = self._ref_key or self.ref._meta.primary_key.name
@@ -763,15 +1022,38 @@ class _ManyToManyBase(property):
     lnk = property(_get_link_class, _set_link_class)
 
     def __get__(self, owner, cls):
-        qs = cls.select('"%s"."%s"=?' % (cls._meta.table_name, cls._meta.primary_key.name), [owner.pk])
-        return ManyToManySet(qs, owner, self.ref, self.lnk)
+        qs = cls.select('%s=?' % cls._meta.quoted_columns[cls._meta.primary_key.name], [owner.pk])
+        return ManyToManySet(qs, owner, self.ref, self.lnk, self.name)
+
+    def prefetch(self, objs):
+        """Loads the related objects of *objs* with a single query, see QuerySet.prefetch()"""
+        ref, lnk = self.ref, self.lnk
+        h = {"ref": ref._meta.quoted_name, "lnk": lnk._meta.quoted_name,
+             "refkey": ref._meta.quoted_columns[ref._meta.primary_key.name],
+             "lnkcls": "%s_id" % self.cls._meta.table_name, "lnkref": "%s_id" % ref._meta.table_name}
+        pks = [obj.pk for obj in objs]
+        if _use_json_each(pks):
+            h["in"], params = "SELECT value FROM json_each(?)", [json.dumps(pks)]
+        else:
+            h["in"], params = ",".join(["?"] * len(pks)), pks
+        # The primary key of the owner is appended to the columns of the related model.
+        sql = 'SELECT %(ref)s.*, %(lnk)s."%(lnkcls)s" AS "macaron.owner" FROM %(ref)s\n' \
+              'INNER JOIN %(lnk)s ON %(lnk)s."%(lnkref)s" = %(refkey)s\n' \
+              'WHERE %(lnk)s."%(lnkcls)s" IN (%(in)s)' % h
+        cur = ref._meta._conn.cursor()
+        cur.execute(sql, params)
+        hydrate = ref._meta.hydrator(cur.description)
+        related = dict([(pk, []) for pk in pks])
+        for row in cur.fetchall(): related[row[-1]].append(hydrate(cur, row))
+        for obj in objs:
+            obj.__dict__.setdefault("_prefetched", {})[self.name] = related[obj.pk]
 
 class ManyToMany(_ManyToManyBase):
     def __init__(self, ref, related_name=None, lnk=None):
         super(ManyToMany, self).__init__(ref, lnk=lnk)
         self.related_name = related_name
 
-    def set_query(self, query_set, tblname, name):
+    def join_clauses(self, tblname, name):
         h = {
             "clstbl": tblname,
             "clskey": self.cls._meta.primary_key.name,
@@ -782,13 +1064,11 @@ class ManyToMany(_ManyToManyBase):
         }
         h["lnkclskey"] = "%s_id" % self.cls._meta.table_name
         h["lnkrefkey"] = "%s_id" % h["reftbl"]
-        query_set.clauses["joins"].append(
-            'INNER JOIN "%(lnktbl)s" AS "%(fldname)s.lnk" ON "%(clstbl)s"."%(clskey)s" = "%(fldname)s.lnk"."%(lnkclskey)s"' % h
-        )
-        query_set.clauses["joins"].append(
-            'INNER JOIN "%(reftbl)s" AS "%(fldname)s" ON "%(fldname)s.lnk"."%(lnkrefkey)s" = "%(fldname)s"."%(refkey)s"' % h
-        )
-        return self.ref, h["fldname"]
+        joins = [
+            'INNER JOIN "%(lnktbl)s" AS "%(fldname)s.lnk" ON "%(clstbl)s"."%(clskey)s" = "%(fldname)s.lnk"."%(lnkclskey)s"' % h,
+            'INNER JOIN "%(reftbl)s" AS "%(fldname)s" ON "%(fldname)s.lnk"."%(lnkrefkey)s" = "%(fldname)s"."%(refkey)s"' % h,
+        ]
+        return joins, self.ref, h["fldname"]
 
     def _called_in_modelmeta_init(self, cls, fld_name):
         # This method will be called in ModelMeta#__init__().
@@ -809,7 +1089,150 @@ class ManyToMany(_ManyToManyBase):
         cls = type(name, (Model,), h)
         return type(name, (Model,), h)
 
+class RelEdge(object):
+    """Edge of the relation graph, which is followed by lookups of QuerySet.select().
+    This is registered into Model._rel_index by :class:`ModelMeta`.
+    """
+    __slots__ = ("rel", "name")
+    def __init__(self, rel, name):
+        self.rel = rel      # ManyToOne, _ManyToOne_Rev or ManyToMany
+        self.name = name    # Attribute name of the relation
+
+    PARENT = "\0"  # Placeholder of the parent alias in templates
+
+    def join(self, alias):
+        """Returns JOIN clauses from the table *alias*, the related model and its alias."""
+        # The clauses are generated once with the placeholder, and shared by all paths.
+        try: clauses, target, target_alias = _join_template_cache[self]
+        except KeyError:
+            clauses, target, target_alias = self.rel.join_clauses(self.PARENT, self.name)
+            _join_template_cache[self] = (clauses, target, target_alias)
+        return [c.replace(self.PARENT, alias) for c in clauses], target, target_alias.replace(self.PARENT, alias)
+
 # --- QuerySet
+def _resolve_path(mdl, path):
+    """Resolves relation path like ('mygroup', 'series') from the model.
+    Returns JOIN clauses, the related model and its table alias.
+    The result is cached per model and path, and shared by lookups through the path.
+    """
+    try: return _join_path_cache[(mdl, path)]
+    except KeyError: pass
+
+    if not path:
+        resolved = ((), mdl, mdl._meta.table_name)
+    else:
+        joins, curmdl, curname = _resolve_path(mdl, path[:-1])
+        clauses, curmdl, curname = curmdl._rel_index[path[-1]].join(curname)
+        resolved = (joins + tuple(clauses), curmdl, curname)
+    if len(_join_path_cache) >= _SELECT_CACHE_SIZE: _join_path_cache.clear()
+    _join_path_cache[(mdl, path)] = resolved
+    return resolved
+
+def _compile_lookup(mdl, key):
+    """Resolves keyword of QuerySet.select() like 'movies__title__in'.
+    Returns JOIN clauses, the quoted column, the field and the operator (or None).
+    The result does not depend on values, so it is cached per model and keyword.
+    """
+    try: return _select_cache[(mdl, key)]
+    except KeyError: pass
+
+    # The path is walked first, so fields named like operators (ex. 'like') are reachable.
+    # The segment after the field is the operator, ex. 'movies__title__in'
+    path, fld = (), None
+    items = key.split("__")
+    while items:
+        item = items.pop(0)
+        curmdl = _resolve_path(mdl, path)[1]
+        if item in curmdl._rel_index:
+            # Fields of ManyToOne, _ManyToOne_Rev, ManyToMany
+            path += (item,)
+        elif item in curmdl._fields:
+            fld = curmdl._fields[item]
+            break
+        elif path and not items and item in OpConverter.OPERATORS:
+            break   # operator after the relation, ex. 'mygroup__in'
+        else:
+            raise RuntimeError("Invalid column name. '%s'" % item)
+    if fld is None: raise RuntimeError("Lookup must end with a field. '%s'" % key)
+
+    # Convert field name and value
+    if len(items) >= 2:
+        raise RuntimeError("Invalid operand name. '%s'" % "__".join(items))
+    op = items[0] if items else None    # unknown operator is rejected by OpConverter
+
+    joins, curmdl, curname = _resolve_path(mdl, path)
+    column = '"%s"."%s"' % (curname, fld.name)
+    if len(_select_cache) >= _SELECT_CACHE_SIZE: _select_cache.clear()
+    compiled = _select_cache[(mdl, key)] = (joins, column, fld, op)
+    return compiled
+
+def _use_json_each(value):
+    """Returns True if the values for IN are passed as a JSON array to json_each().
+    It keeps the SQL the same for any count of values, and the count is not limited
+    by the max number of parameters."""
+    if not _JSON_EACH or len(value) < len(_PLACEHOLDERS): return False
+    for v in value:
+        t = type(v)
+        if t not in _JSON_TYPES: return False
+        # JSON has no NaN and Infinity, and str of Python 2 must be decoded as UTF-8.
+        if t is float and (math.isnan(v) or math.isinf(v)): return False
+        if not PY3K and t is str:
+            try: v.decode("utf-8")
+            except UnicodeDecodeError: return False
+    return True
+
+def _value_shape(value):
+    """Returns the property of the value which changes WHERE clause."""
+    if isinstance(value, Model): return (Model, value.__class__)  # compared with primary key
+    if isinstance(value, (list, tuple)):
+        if _use_json_each(value): return list                   # 'IN (SELECT value FROM json_each(?))'
+        return len(value)                                       # ex. 'IN (?,?,?)'
+    if value is None or value is NotNull: return value          # 'IS NULL', 'IS NOT NULL'
+    if isinstance(value, Like): return Like
+    return True
+
+def _compile_where(mdl, kw):
+    """Compiles keywords of QuerySet.select() like {'movies__title__in': ['A', 'B']}.
+    Returns JOIN clauses, WHERE conditions in parentheses and pairs of (field, operator) for the values.
+    The clauses depend on the keys and the shape of the values, so they are cached per the shape.
+    """
+    shape = (mdl,) + tuple([(k, _value_shape(v)) for k, v in kw.items()])
+    try: return _where_cache[shape]
+    except KeyError: pass
+
+    joins, where, lookups = [], [], []
+    for k, v in kw.items():
+        if isinstance(v, Model):
+            # Specified with Model object
+            k += "__%s" % v._meta.primary_key.name
+            v = v.pk
+
+        # Parsing inline operator
+        clauses, column, fld, op = _compile_lookup(mdl, k)
+        joins += clauses
+        where.append("(%s)" % OpConverter(None).get_clause(op, fld, v, column)[0])
+        lookups.append((fld, op))
+
+    if len(_where_cache) >= _SELECT_CACHE_SIZE: _where_cache.clear()
+    compiled = _where_cache[shape] = (joins, where, lookups)
+    return compiled
+
+def _where_values(kw, lookups):
+    """Returns parameters for the WHERE conditions compiled by _compile_where()"""
+    values = []
+    for v, (fld, op) in zip(kw.values(), lookups):
+        if isinstance(v, Model): v = v.pk
+        prm = OpConverter.get_value(op, fld, v)
+        if prm is not None:
+            if isinstance(prm, (list, tuple)): values += list(prm)
+            else: values.append(prm)
+    return values
+
+class _ExhaustedCursor(object):
+    """Cursor which has no more rows, for objects which have been loaded in advance"""
+    description = None
+    def fetchmany(self, size=None): return []
+
 class QuerySet(object):
     """This class generates SQL which like QuerySet in Django"""
     def __init__(self, parent):
@@ -817,15 +1240,20 @@ class QuerySet(object):
             self.cls = parent.cls
             self.clauses = copy.deepcopy(parent.clauses)
             self.factory = parent.factory   # Factory method converting record to object
+            self.row_cls = parent.row_cls   # Model of the objects, which differs from cls in ManyToManySet
             self.wrapper_clause = parent.wrapper_clause
         else:
             self.cls = parent
-            self.clauses = {"type":"SELECT", "joins":[], "where":[], "order_by":[], "values":[], "distinct":False}
+            self.clauses = {"type":"SELECT", "order_by":[], "values":[], "distinct":False}
+            self.clauses["where"] = []  # conditions in parentheses, which are joined with AND
+            self.clauses["joins"] = collections.OrderedDict()   # JOIN clause -> None, without duplicates
             self.clauses["offset"] = None
             self.clauses["limit"] = None
             self.clauses["order_by"] = self._convert_order_fields(parent.__dict__["_meta"].ordering)
             self.factory = self.cls._factory
-            self.clauses["select_fields"] = '"%s".*' % self.cls.__dict__["_meta"].table_name
+            self.row_cls = self.cls
+            self.clauses["select_fields"] = '%s.*' % self.cls._meta.quoted_name
+            self.clauses["prefetch"] = []   # names of many-to-many relations, see prefetch()
             self.wrapper_clause = None
         self.parent = parent
         self._initialize_cursor()
@@ -835,18 +1263,16 @@ class QuerySet(object):
         self.cur = None     # cursor
         self._index = -1    # pointer
         self._cache = []    # cache list
+        self._rows = collections.deque()    # objects converted from the fetched rows
+        self._fetched_changes = None        # total_changes of the connection when all of the rows are in the cache
 
     def _generate_sql(self):
         # To delete: wrapper_clause is set to DELETE...
         if self.clauses["distinct"]: distinct = "DISTINCT "
         else: distinct = ""
 
-        sqls = ['SELECT %s%s FROM "%s"' % (distinct, self.clauses["select_fields"], self.cls._meta.table_name)]
-
-        if len(self.clauses["joins"]): sqls += self.clauses["joins"]
-
-        if len(self.clauses["where"]):
-            sqls.append("WHERE %s" % " AND ".join(["(%s)" % c for c in self.clauses["where"]]))
+        sqls = ['SELECT %s%s FROM %s' % (distinct, self.clauses["select_fields"], self.cls._meta.quoted_name)]
+        sqls += self._join_and_where_clauses()
 
         if len(self.clauses["order_by"]):
             sqls.append('ORDER BY %s' % ', '.join(self.clauses["order_by"]))
@@ -860,17 +1286,24 @@ class QuerySet(object):
 
     sql = property(_generate_sql)   #: Generating SQL
 
+    def _join_and_where_clauses(self):
+        sqls = list(self.clauses["joins"])
+        if len(self.clauses["where"]):
+            sqls.append("WHERE %s" % " AND ".join(self.clauses["where"]))
+        return sqls
+
     def _execute(self):
         """Getting and setting a new cursor"""
         self._initialize_cursor()
-        self.cur = self.cls._meta._conn.cursor().execute(self.sql, self.clauses["values"])
+        self.cur = self.cls._meta._conn.cursor()
+        self.cur.execute(self.sql, self.clauses["values"])
 
     def _convert_order_fields(self, fields):
         """Convert order ['-id', 'name'] to ['"id" DESC', '"name"']"""
         def conv(m):
             fldname = m.group(1)
             res = '"%s"."%s"' % (m.group(1), m.group(2))
-            fld = self.cls.__dict__.get(fldname, "None")
+            fld = self.cls._relations.get(fldname)
             if not fld: return res
 #            h = {"as":fldname, "me":self.cls._meta.table_name, "me_key":self.cls._meta.primary_key.name}
             h = {"as":fldname, "me":self.cls._meta.table_name, "me_key":fld.fkey}
@@ -883,14 +1316,14 @@ class QuerySet(object):
                 h["refkey"] = fld.rev_fkey
             else: return res
             fmt = 'INNER JOIN "%(ref)s" AS "%(as)s" ON "%(me)s"."%(me_key)s" = "%(as)s"."%(refkey)s"'
-            self.clauses["joins"].append(fmt % h)
+            self.clauses["joins"][fmt % h] = None
             return res
 
         res = []
         for n in fields:
             desc = ""
             if n.startswith("-"): n, desc = n[1:], " DESC"
-            if re.match(r"(\w+)\.(\w+)", n): n = re.sub(r"(\w+)\.(\w+)", conv, n)
+            if _ORDER_FIELD_RE.match(n): n = _ORDER_FIELD_RE.sub(conv, n)
             else: n = '"%s"' % n
             res.append('%s%s' % (n, desc))
         return res
@@ -901,10 +1334,17 @@ class QuerySet(object):
 
     def next(self):
         if not self.cur: self._execute()
-        row = self.cur.fetchone()
+        if not self._rows:
+            # Rows are fetched and converted in a batch
+            cur, factory = self.cur, self.factory
+            self._rows.extend([factory(cur, row) for row in cur.fetchmany(FETCH_SIZE)])
+            if self._rows and self.clauses["prefetch"]:
+                for name in self.clauses["prefetch"]: self.row_cls._relations[name].prefetch(self._rows)
         self._index += 1
-        if not row: raise StopIteration()
-        self._cache.append(self.factory(self.cur, row))
+        if not self._rows:
+            self._fetched_changes = self.cls._meta._conn.total_changes
+            raise StopIteration()
+        self._cache.append(self._rows.popleft())
         return self._cache[-1]
     __next__ = next
 
@@ -921,48 +1361,20 @@ class QuerySet(object):
     def select(self, *args, **kw):
         newset = self.__class__(self)
         if len(args) == 1:
-            newset.clauses["where"].append(args[0])
+            newset.clauses["where"].append("(%s)" % args[0])
         elif len(args) == 2:
-            newset.clauses["where"].append(args[0])
+            newset.clauses["where"].append("(%s)" % args[0])
             if isinstance(args[1], (list, tuple)): newset.clauses["values"] += list(args[1])
             else: newset.clauses["values"].append(args[1])
         elif len(args) > 2:
             raise RuntimeError("arg1 must be primary key value or arg1, arg2 must be where and values.")
 
         # Parse keywords
-        for k, v in kw.items():
-            curmdl = self.cls
-            curname = self.cls._meta.table_name
-
-            if isinstance(v, Model):
-                # Specified with Model object
-                k += "__%s" % v._meta.primary_key.name
-                v = v.pk
-
-            items = k.split("__")
-            while items:
-                item = items.pop(0)
-                fld = curmdl.__dict__[item]
-                if callable(getattr(fld, "set_query", None)):
-                    # Fields of ManyToOne, _ManyToOne_Rev, ManyToMany
-                    curmdl, curname = fld.set_query(newset, curname, item)
-                elif isinstance(fld, Field):
-                    break
-                else:
-                    raise RuntimeError("Invalid column name. '%s(%s)'" % (item, fld.__class__.__name__))
-
-            # Convert field name and value
-            if len(items) >= 2:
-                raise RuntimeError("Invalid operand name. '%s'" % "__".join(items))
-
-            # Parsing inline operator
-            opc = OpConverter(curname)
-            whr, prm = opc.get_clause(items[0] if items else None, fld, v)
-            newset.clauses["where"].append(whr)
-            if prm is not None:
-                if isinstance(prm, (list, tuple)): newset.clauses["values"] += list(prm)
-                else: newset.clauses["values"].append(prm)
-
+        if not kw: return newset
+        joins, where, lookups = _compile_where(self.cls, kw)
+        for join in joins: newset.clauses["joins"][join] = None
+        newset.clauses["where"] += where
+        newset.clauses["values"] += _where_values(kw, lookups)
         return newset
 
     def all(self):
@@ -972,8 +1384,19 @@ class QuerySet(object):
         self.clauses["type"] = "DELETE"
         h = {"tbl": self.cls._meta.table_name, "pk": self.cls._meta.primary_key.name}
         self.wrapper_clause = 'DELETE FROM "%(tbl)s" WHERE "%(pk)s" IN (SELECT "%(pk)s" FROM (\n%%s\n))' % h
+        _get_cache.clear()
         self._execute()
 
+    def prefetch(self, *names):
+        """Loads objects of the many-to-many relations *names* with a query per fetched rows,
+        instead of a query per object."""
+        for name in names:
+            if not isinstance(self.row_cls._relations.get(name), _ManyToManyBase):
+                raise ValueError("'%s' is not a many-to-many relation of '%s'." % (name, self.row_cls.__name__))
+        newset = self.__class__(self)
+        newset.clauses["prefetch"] += names
+        return newset
+
     def distinct(self):
         newset = self.__class__(self)
         newset.clauses["distinct"] = True
@@ -1028,10 +1451,19 @@ class QuerySet(object):
 #        newset.clauses["select_fields"] = '%s("%s")' % (agg.name, agg.field_name)
         newset.wrapper_clause = 'SELECT %s("%s") FROM (\n%%s\n)' % (agg.name, agg.field_name)
         newset.factory = single_value   # Change factory method for single value
+        newset.clauses["prefetch"] = []
         return newset.next()
 
     def count(self):
-        return self.aggregate(Count("*"))
+        # The rows which have been iterated are counted without query, unless rows are written after that.
+        if self._fetched_changes is not None and self._fetched_changes == self.cls._meta._conn.total_changes:
+            return len(self._cache)
+        # Rows are counted by the query itself unless they are changed by DISTINCT, LIMIT etc.
+        c = self.clauses
+        if c["distinct"] or c["limit"] is not None or c["offset"] is not None or self.wrapper_clause:
+            return self.aggregate(Count("*"))
+        sqls = ["SELECT COUNT(*) FROM %s" % self.cls._meta.quoted_name] + self._join_and_where_clauses()
+        return self.cls._meta._conn.cursor().execute("\n".join(sqls), c["values"]).fetchone()[0]
 
     def __str__(self):
         objs = self._cache + [obj for obj in self]
@@ -1052,28 +1484,44 @@ class ManyToOneRevSet(QuerySet):
         return self.cls.create(*args, **kw)
 
 class ManyToManySet(QuerySet):
-    def __init__(self, parent_query, parent_object=None, ref=None, lnk=None):
+    def __init__(self, parent_query, parent_object=None, ref=None, lnk=None, name=None):
         super(ManyToManySet, self).__init__(parent_query)
+        self.name = None    # name of the relation, only for the set got from the object
         # When call on slice procedure of QuerySet, return
         if not(parent_object and ref and lnk): return
 
         self.parent = parent_object
         self.ref = ref
         self.lnk = lnk
+        self.name = name
         clstbl, cls_id = self.cls._meta.table_name, self.cls._meta.primary_key.name
         reftbl, ref_id = ref._meta.table_name, ref._meta.primary_key.name
         lnktbl, lnkcls_id, lnkref_id = lnk._meta.table_name, "%s_id" % clstbl, "%s_id" % reftbl
         self.clauses["select_fields"] = '"%s".*' % reftbl
-        self.clauses["joins"] = [
-            'INNER JOIN "%s" ON "%s"."%s" = "%s"' % (lnktbl, clstbl, cls_id, lnkcls_id),
-            'INNER JOIN "%s" ON "%s" = "%s"."%s"' % (reftbl, lnkref_id, reftbl, ref_id),
-        ]
+        self.clauses["joins"] = collections.OrderedDict([
+            ('INNER JOIN "%s" ON "%s"."%s" = "%s"' % (lnktbl, clstbl, cls_id, lnkcls_id), None),
+            ('INNER JOIN "%s" ON "%s" = "%s"."%s"' % (reftbl, lnkref_id, reftbl, ref_id), None),
+        ])
         self.factory = ref._factory
+        self.row_cls = ref
+
+    def _execute(self):
+        # Objects loaded by QuerySet.prefetch() are returned by next() without query.
+        prefetched = self.name and self.parent.__dict__.get("_prefetched", {}).get(self.name)
+        if prefetched is None: return super(ManyToManySet, self)._execute()
+        self._initialize_cursor()
+        self._rows.extend(prefetched)
+        self.cur = _ExhaustedCursor()
+
+    def _discard_prefetched(self):
+        """Discards prefetched objects, which are changed by appending or popping"""
+        if self.name: self.parent.__dict__.get("_prefetched", {}).pop(self.name, None)
 
     def append(self, *args, **kw):
         if len(args):
             if not isinstance(args[0], self.ref):
                 raise TypeError("Object must be '%s', not '%s'." % (self.ref.__name__, type(args[0]).__name__))
+            self._discard_prefetched()
             h = {
                 "%s_id" % self.cls.__name__.lower(): self.parent.pk,
                 "%s_id" % self.ref.__name__.lower(): args[0].pk,
@@ -1083,16 +1531,29 @@ class ManyToManySet(QuerySet):
         obj = self.ref.create(**kw)
         return self.append(obj)
 
+    def extend(self, objs):
+        """Appends many-to-many links to the objects with a single ``executemany()``"""
+        objs = list(objs)
+        for obj in objs:
+            if not isinstance(obj, self.ref):
+                raise TypeError("Object must be '%s', not '%s'." % (self.ref.__name__, type(obj).__name__))
+        clskey, refkey = "%s_id" % self.cls.__name__.lower(), "%s_id" % self.ref.__name__.lower()
+        self._discard_prefetched()
+        self.lnk.bulk_create([{clskey: self.parent.pk, refkey: obj.pk} for obj in objs])
+        return objs
+
     def pop(self, refobj):
         """Pop many-to-many link object"""
         h = {
             "%s_id" % self.cls.__name__.lower(): self.parent.pk,
             "%s_id" % self.ref.__name__.lower(): refobj.pk,
         }
+        self._discard_prefetched()
         self.lnk.select(**h).delete()
         return refobj
 
     def clear(self):
+        self._discard_prefetched()
         self.lnk.select(**{"%s_id" % self.cls.__name__.lower(): self.parent.pk}).delete()
 
 # --- BaseModel and Model class
@@ -1107,11 +1568,29 @@ class ModelMeta(type):
         dict["_meta"].table_name = dict.pop("_table_name", name.lower())
         dict["_meta"].unique_together = dict.pop("_unique_together", [])
         dict["_meta"].ordering = dict.pop("_ordering", [])
+        dict["_meta"].cache_get = dict.pop("_cache_get", False)
         dict["_meta"].initial_field = {}
+        dict["_fields"] = {}    # name -> Field, including ManyToOne
+        dict["_relations"] = {} # name -> ManyToOne, _ManyToOne_Rev, ManyToMany and its reverse
+        dict["_rel_index"] = {} # name -> RelEdge for relations which can be joined
         for k, v in dict.items():
             if isinstance(v, Field): dict["_meta"].initial_field[k] = v
+            ModelMeta._register_attribute(dict, k, v)
         return type.__new__(cls, name, bases, dict)
 
+    def __setattr__(cls, name, value):
+        # Fields and relations are also set after class creation.
+        # ex. foreign key fields, reverse relations and fields from 'PRAGMA table_info()'
+        type.__setattr__(cls, name, value)
+        ModelMeta._register_attribute(cls.__dict__, name, value)
+
+    @staticmethod
+    def _register_attribute(cdic, name, value):
+        """Registers Field and relation objects into _fields, _relations and _rel_index of the class"""
+        if isinstance(value, Field): cdic["_fields"][name] = value
+        if isinstance(value, (ManyToOne, _ManyToOne_Rev, _ManyToManyBase)): cdic["_relations"][name] = value
+        if isinstance(value, (ManyToOne, _ManyToOne_Rev, ManyToMany)): cdic["_rel_index"][name] = RelEdge(value, name)
+
     def __init__(cls, name, bases, dict):
         # Process suspended initializing
         # 2021-05-29: This process shoud be conducted after next block
@@ -1161,14 +1640,13 @@ class Model(HasModelMeta):
     """Base model class. Models must inherit this class."""
 #    __metaclass__ = ModelMeta
     _table_name = None  #: Database table name (the property will be deleted in ModelMeta)
+    _cache_get = False  #: Caches objects returned by get() (the property will be deleted in ModelMeta)
     _meta = None        #: accessor for TableMetaInfo (set in ModelMeta)
                         #  Accessing to _meta triggers initializing TableMetaInfo and Class attributes.
     def __init__(self, **kw):
-        self._data = {}
-        for fld in self.__class__._meta.fields: self._data[fld.name] = fld.default
+        self._data = self.__class__._meta.defaults.copy()
         for k in kw.keys():
-            if (k not in self.__class__._meta.fields.keys()) \
-                    and not isinstance(self.__class__.__dict__[k], Field):
+            if k not in self._data and k not in self.__class__._fields:
                 raise ValueError("Invalid column name '%s'." % k)
             setattr(self, k, kw[k])
         self._orig_pk = self.pk # Preserve original primary key value for modifing key value
@@ -1182,22 +1660,65 @@ class Model(HasModelMeta):
 
     @classmethod
     def _factory(cls, cur, row):
-        """Convert raw values to object"""
-        h1 = dict([[d[0], row[i]] for i, d in enumerate(cur.description)])
-        h2 = {} # for create a new model object
-        for fld in cls._meta.fields:
-            h2[fld.name] = fld.to_object(sqlite3.Row(cur, row), h1[fld.name])
-        return cls(**h2)
+        """Convert raw values to object.
+        Values from the database are stored into the object directly,
+        without __init__() and validation in Field.__set__().
+        """
+        return cls._meta.hydrator(cur.description)(cur, row)
 
     @classmethod
     def select_from(cls, sql, params=()):
-        objs = []
         cur = execute(sql, params)
-        for row in cur.fetchall(): objs.append(cls._factory(cur, row))
-        return objs
+        if not cur.description: return []   # not a query
+        hydrate = cls._meta.hydrator(cur.description)
+        return [hydrate(cur, row) for row in cur.fetchall()]
 
     @classmethod
-    def get(cls, *args, **kw): return QuerySet(cls).get(*args, **kw)
+    def _get_by_pk(cls, pk):
+        """Model.get() with a primary key value, which does not build QuerySet."""
+        cur = cls._meta._conn.cursor()
+        row = cur.execute(cls._meta.get_sql, [pk]).fetchone()
+        if row is None: raise cls.DoesNotExist("%s object is not found." % cls.__name__)
+        return cls._meta.hydrator(cur.description)(cur, row)
+
+    @classmethod
+    def _get_by_keywords(cls, **kw):
+        """Model.get() with keywords, which does not build QuerySet.
+        The statement is cached per the compiled WHERE clause."""
+        joins, where, lookups = _compile_where(cls, kw)
+        key = (cls, tuple(joins), tuple(where))
+        try: sql = _get_sql_cache[key]
+        except KeyError:
+            sqls = ["SELECT %s.* FROM %s" % (cls._meta.quoted_name, cls._meta.quoted_name)]
+            sqls += list(collections.OrderedDict.fromkeys(joins))  # without duplicates
+            if where: sqls.append("WHERE %s" % " AND ".join(where))
+            if len(_get_sql_cache) >= _SELECT_CACHE_SIZE: _get_sql_cache.clear()
+            sql = _get_sql_cache[key] = "\n".join(sqls)
+        cur = cls._meta._conn.cursor()
+        rows = cur.execute(sql, _where_values(kw, lookups)).fetchmany(2)
+        if not rows: raise cls.DoesNotExist("%s object is not found." % cls.__name__)
+        if len(rows) > 1: raise MultipleObjectsReturned("The 'get()' requires single result.")
+        return cls._meta.hydrator(cur.description)(cur, rows[0])
+
+    @classmethod
+    def get(cls, *args, **kw):
+        by_pk = len(args) == 1 and not kw
+        if by_pk: get = cls._get_by_pk
+        elif not args: get = cls._get_by_keywords
+        else: get = QuerySet(cls).get
+        if not cls.__dict__["_meta"].cache_get: return get(*args, **kw)
+        # The object is cached while it is referenced, until any record is written.
+        # Objects are also kept by (cls, pk), so the same record is the same object.
+        try:
+            if by_pk: key = (cls, args[0])
+            else: key = (cls, tuple([tuple(a) if isinstance(a, list) else a for a in args]), frozenset(kw.items()))
+            return _get_cache[key]
+        except TypeError: return get(*args, **kw)    # unhashable arguments
+        except KeyError: pass
+        obj = get(*args, **kw)
+        obj = _get_cache.setdefault((cls, obj.pk), obj)
+        _get_cache[key] = obj
+        return obj
 
     @classmethod
     def all(cls): return QuerySet(cls).select()
@@ -1213,37 +1734,61 @@ class Model(HasModelMeta):
         for fld in cls._meta.fields:
             if fld.is_primary_key and not getattr(obj, fld.name): continue
             names.append(fld.name)
-        Model._before_before_store(obj, "set", AtCreate)            # set value
+        Model._set_auto_values(obj, AtCreate)   # set value
         obj.before_create()
         obj.validate()
         Model._before_before_store(obj, "to_database", Field)   # convert object to database
         values = [getattr(obj, n) for n in names]
-        holder = ", ".join(["?"] * len(names))
-        sql = 'INSERT INTO "%s" ("%s") VALUES (%s)' % (cls._meta.table_name, '", "'.join(names), holder)
-        cls._save_and_update_object(obj, sql, values)
+        cls._save_and_update_object(obj, cls._meta.insert_sql(names), values)
         obj.after_create()
         return obj
 
+    @classmethod
+    def bulk_create(cls, rows):
+        """Creating new records with a single INSERT executed by ``executemany()``.
+        The *rows* is a list of dicts which are the same as keyword arguments of create().
+        Hooks (before_create() and after_create()) are not called.
+        Returns a list of the new objects, whose primary keys are set if they are INTEGER PRIMARY KEY.
+        """
+        objs = [cls(**kw) for kw in rows]
+        if not objs: return []
+        meta = cls._meta
+        pk_given = [obj.pk is not None for obj in objs]
+        if any(pk_given) and not all(pk_given):
+            raise ValueError("Primary key values must be specified in all rows or none of them.")
+        flds = [fld for fld in meta.fields if not fld.is_primary_key or all(pk_given)]
+        params = []
+        for obj in objs:
+            Model._set_auto_values(obj, AtCreate)   # set value
+            obj.validate()
+            params.append([fld.to_database(obj, getattr(obj, fld.name)) for fld in flds])
+        _get_cache.clear()
+        cur = meta._conn.cursor()
+        cur.executemany(meta.insert_sql([fld.name for fld in flds]), params)
+        if not all(pk_given) and meta.primary_key.type.upper() == "INTEGER":
+            # INTEGER PRIMARY KEY (alias of rowid) values are assigned sequentially in a statement.
+            # Primary keys of other types are left unset.
+            last_id = cur.execute("SELECT last_insert_rowid()").fetchone()[0]
+            for pk, obj in zip(range(last_id - len(objs) + 1, last_id + 1), objs):
+                obj._data[meta.primary_key.name] = pk
+        for obj in objs: obj._orig_pk = obj.pk
+        return objs
+
     def save(self):
         """Updating the record"""
         cls = self.__class__
-        names = []
-        for fld in cls._meta.fields:
-#            if fld.is_primary_key: continue
-            names.append(fld.name)
-        holder = ", ".join(['"%s" = ?' % n for n in names])
-        Model._before_before_store(self, "set", AtSave) # set value
+        Model._set_auto_values(self, AtSave) # set value
         self.validate()
         self.before_save()
         Model._before_before_store(self, "to_database", Field)  # convert object to database
-        values = [getattr(self, n) for n in names]
-        sql = 'UPDATE "%s" SET %s WHERE "%s" = ?' % (cls._meta.table_name, holder, cls._meta.primary_key.name)
-        cls._save_and_update_object(self, sql, values + [self._orig_pk]) # '_orig_pk' is preserved key value (see __init__)
+        values = list(cls._meta.values_of(self._data))
+        cls._save_and_update_object(self, cls._meta.update_sql, values + [self._orig_pk]) # '_orig_pk' is preserved key value (see __init__)
         self.after_save()
 
     @staticmethod
     def _save_and_update_object(obj, sql, values):
         cls = obj.__class__
+        _get_cache.clear()
         cur = cls._meta._conn.cursor().execute(sql, values)
         if obj.pk == None: current_id = cur.lastrowid
         else: current_id = obj.pk
@@ -1254,17 +1799,24 @@ class Model(HasModelMeta):
     def delete(self):
         """Deleting the record"""
         cls = self.__class__
-        sql = 'DELETE FROM "%s" WHERE "%s" = ?' % (cls._meta.table_name, cls._meta.primary_key.name)
-        cls._meta._conn.cursor().execute(sql, [self.pk])
+        _get_cache.clear()
+        cls._meta._conn.cursor().execute(cls._meta.delete_sql, [self.pk])
+
+    @staticmethod
+    def _set_auto_values(obj, at_cls):
+        # Values of AtCreate/AtSave fields are validated in validate() after this,
+        # so they are stored directly without validation in Field.__set__().
+        data = obj._data
+        for fld in obj.__class__._meta.fields_of(at_cls):
+            data[fld.name] = fld.cast(fld.set(obj, data.get(fld.name)))
 
     @staticmethod
     def _before_before_store(obj, meth_name, at_cls):
         cls = obj.__class__
         # set value with at_cls object
-        for fld in cls._meta.fields:
-            if isinstance(fld, at_cls):
-                converter = getattr(fld, meth_name)
-                setattr(obj, fld.name, converter(obj, getattr(obj, fld.name)))
+        for fld in cls._meta.fields_of(at_cls):
+            converter = getattr(fld, meth_name)
+            setattr(obj, fld.name, converter(obj, getattr(obj, fld.name)))
 
     def validate(self):
         cls = self.__class__
@@ -1307,21 +1859,41 @@ class OpConverter(object):
     }
     def __init__(self, tblname): self.tblname = tblname
 
-    def get_clause(self, op, fld, value):
+    def get_clause(self, op, fld, value, column=None):
+        """Returns WHERE clause and the value. The *column* is a quoted column name
+        (ex. '"member"."name"'), which is generated from *tblname* if it is omitted."""
         if op:
-            if hasattr(self, "_OP_%s" % op): sqltmpl, value = getattr(self, "_OP_%s" % op)(value)
-            elif op in self.CONV: sqltmpl, value = "%%s %s ?" % self.CONV[op], value
-            else: raise ValueError("Operator '%s' is not supported." % op)
+            try: handler = self.OPERATORS[op]
+            except KeyError: raise ValueError("Operator '%s' is not supported." % op)
+            sqltmpl, value = handler(self, value)
         else:
             sqltmpl, value = self._convert(fld, value)
-        return sqltmpl % '"%s"."%s"' % (self.tblname, fld.name), value
+        return sqltmpl % (column or '"%s"."%s"' % (self.tblname, fld.name)), value
+
+    @staticmethod
+    def get_value(op, fld, value):
+        """Returns the parameter of the clause, which is the same as get_clause() returns."""
+        if op in ("in", "not_in") and _use_json_each(value): return json.dumps(list(value))
+        if op: return value     # operators take the value as it is
+        if value is None or value is NotNull: return None
+        if isinstance(value, Like): return value.likestr
+        return fld.to_database(None, value)
 
-    def _base_in(self, op, value): return "%%s %s (%s)" % (op, ",".join(["?"] * len(value))), value
+    @staticmethod
+    def _binary_operator(sql):
+        tmpl = "%%s %s ?" % sql
+        return lambda self, value: (tmpl, value)
+
+    def _base_in(self, op, value):
+        if _use_json_each(value): return "%%s %s (SELECT value FROM json_each(?))" % op, json.dumps(list(value))
+        n = len(value)
+        holder = _PLACEHOLDERS[n] if n < len(_PLACEHOLDERS) else ",".join(["?"] * n)
+        return "%%s %s (%s)" % (op, holder), value
     def _OP_in(self, value): return self._base_in("IN", value)
     def _OP_not_in(self, value): return self._base_in("NOT IN", value)
 
     def _base_between(self, op, value):
-        if not isinstance(value, collections.Iterable): raise TypeError("Between operator requires a list")
+        if not isinstance(value, (tuple, list)): raise TypeError("Between operator requires a list")
         if len(value) != 2: raise ValueError("Between operator requires a list which consists of 2 values.")
         return "%%s %s ? AND ?" % op, value
     def _OP_between(self, value): return self._base_between("BETWEEN", value)
@@ -1333,6 +1905,10 @@ class OpConverter(object):
         if isinstance(value, Like): return "%s LIKE ?", value.likestr
         return "%s = ?", fld.to_database(None, value)
 
+# Operator name -> handler(converter, value), ex. 'not_in' -> OpConverter._OP_not_in
+OpConverter.OPERATORS = dict([(op, OpConverter._binary_operator(sql)) for op, sql in OpConverter.CONV.items()])
+OpConverter.OPERATORS.update([(k[4:], v) for k, v in vars(OpConverter).items() if k.startswith("_OP_")])
+
 # --- Plugin for Bottle web framework
 class MacaronPlugin(object):
     """Bottle plugin for Macaron"""
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 # Project: Macaron O/R Mapper
 # Module:  Test models
+import unittest
 import macaron
 
 class Team(macaron.Model):
@@ -27,3 +28,28 @@ class Member(macaron.Model):
 class Song(macaron.Model):
     name        = macaron.CharField(max_length=50)
     members     = macaron.ManyToMany(Member, related_name="songs")
+
+class SharedTablesTestCase(unittest.TestCase):
+    """Base class of the tests which share the connection and the tables in the class.
+    The tables of the models in ``tables`` are created once and emptied after each test."""
+    tables = ()
+    lazy = True
+
+    @classmethod
+    def setUpClass(cls):
+        macaron.macaronage(":memory:", lazy=cls.lazy)
+        macaron.create_tables(*cls.tables)
+
+    @classmethod
+    def tearDownClass(cls):
+        macaron.cleanup()
+
+    def tearDown(self):
+        macaron.bake()
+        # Tables have no AUTOINCREMENT, so ids restart from 1 after deleting all records.
+        # The referring tables are emptied first for the foreign keys.
+        for mdl in reversed(self.tables):
+            for fld in mdl._relations.values():
+                if isinstance(fld, macaron.ManyToMany): macaron.execute('DELETE FROM "%s"' % fld.lnk._meta.table_name)
+            macaron.execute('DELETE FROM "%s"' % mdl._meta.table_name)
+        macaron.bake()
@@ -5,20 +5,13 @@ Test for class attributes.
 """
 import unittest
 import macaron
-from models import Team, Member, Song
+from models import Team, Member, Song, SharedTablesTestCase
 
 DB_FILE = ":memory:"
 
-class TestClassAttributes(unittest.TestCase):
-    def setUp(self):
-        macaron.macaronage(DB_FILE)
-        macaron.create_table(Team)
-        macaron.create_table(Member)
-        macaron.create_table(Song)
-
-    def tearDown(self):
-        macaron.bake()
-        macaron.cleanup()
+class TestClassAttributes(SharedTablesTestCase):
+    tables = (Team, Member, Song)
+    lazy = False
 
     def testTableMetaInfo(self):
         # TableMetaInfo object from Team class
@@ -72,6 +65,15 @@ class TestClassAttributes(unittest.TestCase):
         self.assertEqual(member_set.parent_key, "id", "parent_key == fld.ref_key")
         self.assertEqual(member_set.cls_fkey, "band_id", "cls_fkey == fld.rev_fkey")
 
+        # Fields and relations are registered to the class by ModelMeta
+        self.assertIs(Team._fields["id"], Team.__dict__["id"])
+        self.assertIs(Team._relations["members"], Team.__dict__["members"])
+        self.assertIs(Member._fields["band_id"], Member.__dict__["band_id"])
+        self.assertIs(Member._relations["band"], Member.__dict__["band"])
+        self.assertFalse("members" in Team._fields)
+        self.assertIs(Team._rel_index["members"].rel, Team.__dict__["members"])
+        self.assertEqual(Member._rel_index["band"].name, "band")
+
     def testBaseTableFields(self):
         # tests Member
         fld = Member.__dict__["id"]
@@ -7,11 +7,11 @@ Testing for basic usage.
 """
 import unittest, warnings
 import macaron
-from models import Team, Member, Song
+from models import Team, Member, Song, SharedTablesTestCase
 
 DB_FILE = ":memory:"
 
-class TestBasicDefinitionAndOperation(unittest.TestCase):
+class TestBasicDefinitionAndOperation(SharedTablesTestCase):
     names = [
         ("Ritsu", "Tainaka", "Dr", "Ritsu Tainaka : Dr"),
         ("Mio", "Akiyama", "Ba", "Mio Akiyama : Ba"),
@@ -19,26 +19,13 @@ class TestBasicDefinitionAndOperation(unittest.TestCase):
         ("Tsumugi", "Kotobuki", "Kb", "Tsumugi Kotobuki : Kb"),
     ]
 
-    def setUp(self):
-        macaron.macaronage(DB_FILE, lazy=True)
-        macaron.create_table(Team)
-        macaron.create_table(Member)
-        macaron.create_table(Song)
-
-    def tearDown(self):
-        macaron.bake()
-        macaron.cleanup()
-
-    def _compare_schema(self, tbl_name, sql_lines):
-        cur = macaron.execute("SELECT sql FROM sqlite_master WHERE name = ?", [tbl_name])
-        tbl_lines = cur.fetchone()[0].splitlines()
-        self.assertEqual(len(tbl_lines), len(sql_lines))
-        cnt = 0
-        for line in tbl_lines:
-            self.assertEqual(line, sql_lines.pop(0))
-            cnt += 1
-        self.assertEqual(cnt, len(tbl_lines))
-        self.assertEqual(len(sql_lines), 0)
+    tables = (Team, Member, Song)
+
+    def _compare_schema(self, cls, sql_lines):
+        cur = macaron.execute("SELECT sql FROM sqlite_master WHERE name = ?", [cls._meta.table_name])
+        tbl_sql = cur.fetchone()[0]
+        self.assertEqual(tbl_sql, cls.__dict__["_meta"].ddl_sql)  # generated once by create_table()
+        self.assertEqual(tbl_sql, "\n".join(sql_lines))
 
     def testTableSchema(self):
         # Assert table schemas
@@ -51,7 +38,7 @@ class TestBasicDefinitionAndOperation(unittest.TestCase):
             '  "start_date" DATE',
             ')',
         ]
-        self._compare_schema("team", sql_lines)
+        self._compare_schema(Team, sql_lines)
 
         # Member table
         sql_lines = [
@@ -68,7 +55,7 @@ class TestBasicDefinitionAndOperation(unittest.TestCase):
             '  "modified" TIMESTAMP',
             ')',
         ]
-        self._compare_schema("member", sql_lines)
+        self._compare_schema(Member, sql_lines)
 
         # Song table
         sql_lines = [
@@ -77,7 +64,7 @@ class TestBasicDefinitionAndOperation(unittest.TestCase):
             '  "name" VARCHAR(50) NOT NULL',
             ')',
         ]
-        self._compare_schema("song", sql_lines)
+        self._compare_schema(Song, sql_lines)
 
     def testLinkTable(self):
         # SongMemberLink table
@@ -92,7 +79,7 @@ class TestBasicDefinitionAndOperation(unittest.TestCase):
             '  "member_id" INTEGER NOT NULL REFERENCES "member"("id") ON DELETE CASCADE ON UPDATE CASCADE',
             ')',
         ]
-        self._compare_schema(tbl_name, sql_lines)
+        self._compare_schema(rel._lnk, sql_lines)
 
     def testCRUDObject(self):
         # Test for creating, reading, updating, deleteing
@@ -198,13 +185,30 @@ class TestBasicDefinitionAndOperation(unittest.TestCase):
             msg = "Foreign key constraint works on SQLite(3.6.19) > Current(%s). Skip."
             warnings.warn(msg % ".".join([str(x) for x in ver]))
 
+    def testBulkCreateWithTextKey(self):
+        class Label(macaron.Model):
+            code = macaron.CharField(max_length=6, primary_key=True, null=True)
+            name = macaron.CharField(max_length=20)
+        macaron.create_table(Label)
+        # Primary keys which are not INTEGER PRIMARY KEY are not guessed from rowid.
+        labels = Label.bulk_create([dict(name="Ritsu"), dict(name="Mio")])
+        self.assertEqual([l.pk for l in labels], [None, None])
+        labels = Label.bulk_create([dict(code="A", name="Yui"), dict(code="B", name="Azusa")])
+        self.assertEqual([l.pk for l in labels], ["A", "B"])
+
     def testAggregation(self):
         team = Team.create(name="Houkago Tea Time")
-        team.members.append(first_name="Ritsu"  , last_name="Tainaka" , part="Dr" , age=17)
-        team.members.append(first_name="Mio"    , last_name="Akiyama" , part="Ba" , age=17)
-        team.members.append(first_name="Yui"    , last_name="Hirasawa", part="Gt1", age=17)
-        team.members.append(first_name="Tsumugi", last_name="Kotobuki", part="Kb" , age=16)
-        team.members.append(first_name="Azusa"  , last_name="Nakano"  , part="Gt2", age=17)
+        members = Member.bulk_create([
+            dict(band=team, first_name="Ritsu"  , last_name="Tainaka" , part="Dr" , age=17),
+            dict(band=team, first_name="Mio"    , last_name="Akiyama" , part="Ba" , age=17),
+            dict(band=team, first_name="Yui"    , last_name="Hirasawa", part="Gt1", age=17),
+            dict(band=team, first_name="Tsumugi", last_name="Kotobuki", part="Kb" , age=16),
+            dict(band=team, first_name="Azusa"  , last_name="Nakano"  , part="Gt2", age=17),
+        ])
+        self.assertEqual([m.pk for m in members], [1, 2, 3, 4, 5])
+        self.assertEqual(members[4], Member.get(5))
+        self.assertEqual(Member.get(5).first_name, "Azusa")
+        self.assertTrue(Member.get(1).created)
 
         a = ("Akiyama", "Hirasawa", "Kotobuki", "Nakano", "Tainaka")
         for i, m in enumerate(Team.get(1).members.order_by("last_name")):
@@ -212,6 +216,18 @@ class TestBasicDefinitionAndOperation(unittest.TestCase):
 
         cnt = team.members.count()
         self.assertEqual(cnt, 5)
+        self.assertEqual(team.members.select(age=17).count(), 4)
+        self.assertEqual(team.members.all().limit(3).count(), 3)
+        self.assertEqual(team.members.all().offset(3).count(), 2)
+
+        # Counted with the cache after iteration
+        qs = team.members.all()
+        self.assertEqual(len([m for m in qs]), 5)
+        self.assertEqual(qs.count(), 5)
+        jun = Member.create(band=team, first_name="Jun", last_name="Suzuki", part="Dr")
+        self.assertEqual(qs.count(), 6)    # rows are written after the iteration
+        jun.delete()
+        self.assertEqual(qs.count(), 5)
 
         sum_of_ages = team.members.all().aggregate(macaron.Sum("age"))
         self.assertEqual(sum_of_ages, 84)
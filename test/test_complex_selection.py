@@ -3,7 +3,10 @@ import unittest
 from datetime import datetime
 import macaron
 
-class Series(macaron.Model): name = macaron.CharField(max_length=30)
+class Series(macaron.Model):
+    _cache_get = True
+    name = macaron.CharField(max_length=30)
+
 class Movie(macaron.Model): title = macaron.CharField(max_length=20)
 
 class Group(macaron.Model):
@@ -24,32 +27,83 @@ class SubTitle(macaron.Model):
 class ComplexSelectionTestCase(unittest.TestCase):
     def setUp(self):
         macaron.macaronage(":memory:")
-        macaron.create_table(Series)
-        macaron.create_table(Group)
-        macaron.create_table(Movie)
-        macaron.create_table(Member)
-        macaron.create_table(SubTitle)
-
-        series1 = Series.create(name="Smile Precure")
-        group1 = Group.create(name="Smile", series=series1)
-        group2 = Group.create(name="Pink", series=series1)
-        member1 = Member.create(curename="Happy", mygroup=group1, subgroup=group2, joined=datetime(2012, 2, 6))
-        movie1 = Movie.create(title="NewStage")
-        subtitle = SubTitle.create(title="Mirai no tomodachi", movie=movie1)
-        member1.movies.append(movie1)
-
-        series2 = Series.create(name="Happiness Charge Precure")
-        group3 = Group.create(name="Happiness Charge", series=series2)
-        group4 = Group.create(name="Purple", series=series2)
-        member2 = Member.create(curename="Fortune", mygroup=group3, subgroup=group4, joined=datetime(2014, 2, 9))
-        movie2 = Movie.create(title="NewStage2")
-        subtitle2 = SubTitle.create(title="Eien no tomodachi", movie=movie2)
-        member2.movies.append(movie2)
+        macaron.create_tables(Series, Group, Movie, Member, SubTitle)
+
+        with macaron.transaction():
+            series1, series2 = Series.bulk_create([
+                dict(name="Smile Precure"),
+                dict(name="Happiness Charge Precure"),
+            ])
+            group1, group2, group3, group4 = Group.bulk_create([
+                dict(name="Smile", series=series1),
+                dict(name="Pink", series=series1),
+                dict(name="Happiness Charge", series=series2),
+                dict(name="Purple", series=series2),
+            ])
+            member1, member2 = Member.bulk_create([
+                dict(curename="Happy", mygroup=group1, subgroup=group2, joined=datetime(2012, 2, 6)),
+                dict(curename="Fortune", mygroup=group3, subgroup=group4, joined=datetime(2014, 2, 9)),
+            ])
+            movie1, movie2 = Movie.bulk_create([dict(title="NewStage"), dict(title="NewStage2")])
+            SubTitle.bulk_create([
+                dict(title="Mirai no tomodachi", movie=movie1),
+                dict(title="Eien no tomodachi", movie=movie2),
+            ])
+            member1.movies.append(movie1)
+            member2.movies.append(movie2)
 
     def tearDown(self):
         macaron.bake()
         macaron.cleanup()
 
+    def test_create_tables(self):
+        class Extra(macaron.Model): name = macaron.CharField(max_length=10)
+        macaron.bake()
+        # Tables are created in a transaction, so Extra is rolled back.
+        self.assertRaises(Series.TableAlreadyExists, macaron.create_tables, Extra, Series)
+        cur = macaron.execute("SELECT * FROM sqlite_master WHERE type = 'table' AND name = 'extra'")
+        self.assertEqual(cur.fetchall(), [])
+
+    def test_field_named_like_operator(self):
+        class Tag(macaron.Model): like = macaron.IntegerField()
+        class Post(macaron.Model): tag = macaron.ManyToOne(Tag, related_name="posts")
+        macaron.create_tables(Tag, Post)
+        Post.create(tag=Tag.create(like=3))
+        self.assertEqual(Post.select(tag__like=3).count(), 1)
+        self.assertEqual(Post.select(tag__like__gt=3).count(), 0)
+        self.assertRaises(RuntimeError, Post.select, tag=1)
+        self.assertRaises(RuntimeError, Post.select, tag__in=[1])
+
+    def test_memory_db_pragmas(self):
+        self.assertEqual(macaron.execute("PRAGMA synchronous").fetchone()[0], 0)   # OFF
+        self.assertEqual(macaron.execute("PRAGMA temp_store").fetchone()[0], 2)    # MEMORY
+        self.assertEqual(macaron.execute("PRAGMA foreign_keys").fetchone()[0], 1)
+        self.assertEqual(macaron.execute("PRAGMA journal_mode").fetchone()[0], "memory")
+
+        # Other test modules use LazyConnection, which connects with the same PRAGMAs.
+        macaron.macaronage(":memory:", lazy=True)
+        self.assertEqual(macaron.execute("PRAGMA synchronous").fetchone()[0], 0)
+        self.assertEqual(macaron.execute("PRAGMA journal_mode").fetchone()[0], "memory")
+
+    def test_cached_get(self):
+        series = Series.get(name="Smile Precure")
+        self.assertIs(Series.get(name="Smile Precure"), series)
+        series1 = Series.get(1)
+        self.assertIs(Series.get(1), series1)
+        self.assertIs(series1, series)    # same record, same object
+        group1 = Group.get(1)
+        self.assertIsNot(Group.get(1), group1)    # not cached
+
+        # Cached objects are discarded by writing
+        series.name = "Smile Precure!"
+        series.save()
+        self.assertIsNot(Series.get(1), series)
+        self.assertEqual(Series.get(1).name, "Smile Precure!")
+        self.assertRaises(Series.DoesNotExist, Series.get, name="Smile Precure")
+        self.assertRaises(Group.DoesNotExist, Group.get, 100)
+        self.assertRaises(macaron.MultipleObjectsReturned, Group.get, series__name="Smile Precure!")
+        self.assertEqual(Member.get(mygroup__name="Smile", subgroup__series__name="Smile Precure!").curename, "Happy")
+
     def test_basic_selection(self):
         sql = 'SELECT "member".* FROM "member"\nWHERE ("member"."curename" = ?)'
         qs = Member.select(curename="Happy")
@@ -84,6 +138,14 @@ class ComplexSelectionTestCase(unittest.TestCase):
         self.assertEqual(qs[0].curename, "Happy")
         self.assertEqual(qs[1].curename, "Fortune")
 
+    def test_re2_regexp(self):
+        if macaron.re2 is None:
+            self.assertRaises(ImportError, macaron.macaronage, ":memory:", regexp=macaron.re2_regexp)
+            self.skipTest("google-re2 is not installed")
+        self.assertTrue(macaron.re2_regexp("New.+", "NewStage"))
+        self.assertFalse(macaron.re2_regexp(r"^\w+$", u"\u30d7\u30ea\u30ad\u30e5\u30a2"))
+        self.assertTrue(macaron.re2_regexp(r"(a)\1", "aa"))  # backreference is compiled by re
+
     def test_in(self):
         sql  = 'SELECT "member".* FROM "member"\n'
         sql += 'INNER JOIN "membermovielink" AS "member.movies.lnk" ON "member"."id" = "member.movies.lnk"."member_id"\n'
@@ -104,6 +166,24 @@ class ComplexSelectionTestCase(unittest.TestCase):
         self.assertEqual(qs.sql, sql)
         self.assertEqual(qs.count(), 0)
 
+    def test_in_many_values(self):
+        if macaron.sqlite_version_info < (3, 38, 0): self.skipTest("JSON functions are not built in")
+        titles = ["NewStage"] + ["Movie%d" % i for i in range(100)]
+        qs = Member.select(movies__title__in=titles)
+        self.assertTrue(qs.sql.endswith('WHERE ("member.movies"."title" IN (SELECT value FROM json_each(?)))'))
+        # 64 or more values are passed as JSON
+        self.assertTrue(Member.select(movies__title__in=titles[:64]).sql.endswith("json_each(?)))"))
+        self.assertFalse(Member.select(movies__title__in=titles[:63]).sql.endswith("json_each(?)))"))
+        # Values which are not valid in JSON use the placeholders.
+        qs = Member.select(movies__title__in=titles + [float("nan")])
+        self.assertFalse(qs.sql.endswith("json_each(?)))"))
+        self.assertEqual(qs.count(), 1)
+        if not macaron.PY3K:
+            self.assertFalse(Member.select(movies__title__in=titles + ["\xff"]).sql.endswith("json_each(?)))"))
+        self.assertEqual(qs.count(), 1)
+        self.assertEqual(qs[0].curename, "Happy")
+        self.assertEqual(Member.select(movies__title__not_in=titles).count(), 1)
+
     def test_between(self):
         sql  = 'SELECT "member".* FROM "member"\n'
         sql += 'WHERE ("member"."joined" BETWEEN ? AND ?)'
@@ -159,6 +239,16 @@ class ComplexSelectionTestCase(unittest.TestCase):
         self.assertEqual(qs.count(), 1)
         for rec in qs: self.assertEqual(rec.curename, "Happy")
 
+        # JOIN clause for the same relation appears only once
+        sql  = 'SELECT "member".* FROM "member"\n'
+        sql += 'INNER JOIN "group" AS "member.mygroup" ON "member"."mygroup_id" = "member.mygroup"."id"\n'
+        sql += 'INNER JOIN "series" AS "member.mygroup.series" ON "member.mygroup"."series_id" = "member.mygroup.series"."id"\n'
+        sql += 'WHERE ("member.mygroup"."name" = ?) AND ("member.mygroup.series"."name" = ?)'
+        qs = Member.select(mygroup__name="Smile").select(mygroup__series__name="Smile Precure")
+        self.assertEqual(qs.sql, sql)
+        self.assertEqual(qs.count(), 1)
+        for rec in qs: self.assertEqual(rec.curename, "Happy")
+
     def test_selection_with_m2m(self):
         sql  = 'SELECT "member".* FROM "member"\n'
         sql += 'INNER JOIN "membermovielink" AS "member.movies.lnk" ON "member"."id" = "member.movies.lnk"."member_id"\n'
@@ -209,6 +299,27 @@ class ComplexSelectionTestCase(unittest.TestCase):
         fortune = Member.get(curename="Fortune")
         self.assertEqual(fortune.movies.count(), 2)
 
+    def test_prefetch(self):
+        members = Member.all().prefetch("movies")
+        self.assertEqual([[mv.title for mv in m.movies] for m in members], [["NewStage"], ["NewStage2"]])
+        movies = list(Movie.all().prefetch("members"))
+        self.assertEqual([[m.curename for m in mv.members] for mv in movies], [["Happy"], ["Fortune"]])
+        self.assertEqual(movies[0].members.count(), 1)
+        self.assertEqual(movies[1].members[0].curename, "Fortune")
+        self.assertEqual(list(Member.all().prefetch("movies"))[0].movies[0].title, "NewStage")
+        self.assertRaises(ValueError, Member.all().prefetch, "mygroup")
+
+        # Through a many-to-many set, names are of the related model
+        movies = list(Member.get(1).movies.prefetch("members"))
+        self.assertEqual([[m.curename for m in mv.members] for mv in movies], [["Happy"]])
+        self.assertRaises(ValueError, Member.get(1).movies.prefetch, "movies")
+
+        # Prefetched objects are discarded by appending
+        member = members[0]
+        member.movies.append(Movie.get(2))
+        self.assertEqual([mv.title for mv in member.movies], ["NewStage", "NewStage2"])
+        self.assertEqual(Member.select(curename="Happy").prefetch("movies").count(), 1)
+
     def test_select_from(self):
         members = Member.select_from("SELECT * FROM member WHERE id = 1")
         self.assertTrue(isinstance(members, list))
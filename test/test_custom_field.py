@@ -3,16 +3,26 @@
 """
 Test custom field
 """
-import unittest, time
-try: import simplejson as json
-except ImportError: import json
+import unittest
+from datetime import timedelta
+try:
+    import orjson
+    def json_dumps(value): return orjson.dumps(value).decode("utf-8")
+    json_loads = orjson.loads
+except ImportError:
+    try: import ujson as json
+    except ImportError:
+        try: import simplejson as json
+        except ImportError: import json
+    json_dumps, json_loads = json.dumps, json.loads
 import macaron
+from models import SharedTablesTestCase
 
 DB_FILE = ":memory:"
 
 class StoreJSONField(macaron.CharField):
-    def to_database(self, obj, value): return json.dumps(value)
-    def to_object(self, row, value): return json.loads(value)
+    def to_database(self, obj, value): return json_dumps(value)
+    def to_object(self, row, value): return json_loads(value)
 
 class MyRecord(macaron.Model):
     name        = macaron.CharField(max_length=20)
@@ -21,25 +31,12 @@ class MyRecord(macaron.Model):
     modified    = macaron.TimestampAtSave()
     def __str__(self): return "<MyRecord '%s' is '%s'>" % (self.name, str(self.value))
 
-class TestCustomField(unittest.TestCase):
-    def setUp(self):
-        macaron.macaronage(dbfile=DB_FILE, lazy=True)
-        macaron.create_table(MyRecord)
-
-    def tearDown(self):
-        macaron.bake()
-        macaron.cleanup()
+class TestCustomField(SharedTablesTestCase):
+    tables = (MyRecord,)
 
     def _compare_schema(self, tbl_name, sql_lines):
         cur = macaron.execute("SELECT sql FROM sqlite_master WHERE name = ?", [tbl_name])
-        tbl_lines = cur.fetchone()[0].splitlines()
-        self.assertEqual(len(tbl_lines), len(sql_lines))
-        cnt = 0
-        for line in tbl_lines:
-            self.assertEqual(line, sql_lines.pop(0))
-            cnt += 1
-        self.assertEqual(cnt, len(tbl_lines))
-        self.assertEqual(len(sql_lines), 0)
+        self.assertEqual(cur.fetchone()[0], "\n".join(sql_lines))
 
     def testTableDefinition(self):
         sql_lines = [
@@ -59,11 +56,13 @@ class TestCustomField(unittest.TestCase):
         self.assert_(newrec.modified)
         created = newrec.created
         modified = newrec.modified
-        time.sleep(2)   # wait for changing time
         rec = MyRecord.get(1)
         self.assertEqual(rec.value["Macaron"], "Good!")
         rec.value = {"Macaron":"Excellent!!"}
-        rec.save()
+        now = macaron._now
+        macaron._now = lambda: now() + timedelta(seconds=2)  # time passes without waiting
+        try: rec.save()
+        finally: macaron._now = now
         self.assertEqual(rec.created, created, "When saving, created time is not changed")
         self.assertNotEqual(rec.modified, modified, "When saving, modified time is updated")
 
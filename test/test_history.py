@@ -15,17 +15,18 @@ SQL_TEST = """CREATE TABLE IF NOT EXISTS t_test (
 )"""
 
 class TestHistoryLogger(unittest.TestCase):
-    def setUp(self): pass
-    def tearDown(self): pass
+    def setUp(self): self.handler = None
+    def tearDown(self):
+        if self.handler: logging.getLogger("macaron.sql").removeHandler(self.handler)
 
     def testLoggerWithWrapper(self):
-        logger = logging.getLogger()
+        logger = logging.getLogger("macaron.sql")
         logger.setLevel(logging.DEBUG)
-        sql_logger = macaron.ListHandler(10)
+        sql_logger = self.handler = macaron.ListHandler(10)
         logger.addHandler(sql_logger)
 
         conn = sqlite3.connect(DB_FILE, factory=macaron._create_wrapper(logger))
-        conn.execute(SQL_TEST)
+        conn.cursor().execute(SQL_TEST)
         self.assertEqual(str(sql_logger[0]), "%s\nparams: []" % SQL_TEST)
         conn.close()
 
@@ -33,18 +34,19 @@ class TestHistoryLogger(unittest.TestCase):
         macaron.macaronage(DB_FILE, history=10)
         macaron.execute(SQL_TEST)
         self.assertEqual(str(macaron.history[0]), "%s\nparams: []" % SQL_TEST)
+        self.handler = macaron.history
         macaron.cleanup()
 
     def testMacaronOption_HistoryDisabled(self):
         macaron.macaronage(DB_FILE)
-        def _history_is_disabled(): macaron.history[0]
-        self.assertRaises(RuntimeError, _history_is_disabled)
+        self.assertFalse(macaron.history.enabled)
+        with self.assertRaises(RuntimeError): macaron.history[0]
         macaron.cleanup()
 
     def testMacaronOption_HistoryIndex(self):
         macaron.macaronage(DB_FILE, history=10)
-        def _index_error(): macaron.history[10]
-        self.assertRaises(IndexError, _index_error)
+        self.assertTrue(macaron.history.enabled)
+        with self.assertRaises(IndexError): macaron.history[10]
         macaron.cleanup()
 
 if __name__ == "__main__":
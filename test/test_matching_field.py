@@ -1,18 +1,14 @@
 #!/usr/bin/env python
 import unittest
 import macaron
+from models import SharedTablesTestCase
 
 class Member(macaron.Model):
     curename = macaron.MatchingField("Cure .+$", max_length=30)
 
-class MatchingFieldTestCase(unittest.TestCase):
-    def setUp(self):
-        macaron.macaronage(":memory:")
-        macaron.create_table(Member)
-
-    def tearDown(self):
-        macaron.bake()
-        macaron.cleanup()
+class MatchingFieldTestCase(SharedTablesTestCase):
+    tables = (Member,)
+    lazy = False
 
     def test_basic(self):
         Member.create(curename="Cure Lovely")
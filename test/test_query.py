@@ -7,29 +7,30 @@ Testing for basic usage.
 """
 import unittest, warnings
 import macaron
-from models import Team, Member, Song
+from models import Team, Member, Song, SharedTablesTestCase
 
-DB_FILE = ":memory:"
-
-class TestQueryOperation(unittest.TestCase):
-    names = [
+class TestQueryOperation(SharedTablesTestCase):
+    fields = ("first_name", "last_name", "part", "age")
+    names = (
         ("Ritsu"  , "Tainaka" , "Dr" , 17),
         ("Mio"    , "Akiyama" , "Ba" , 17),
         ("Yui"    , "Hirasawa", "Gt1", 17),
         ("Tsumugi", "Kotobuki", "Kb" , 17),
         ("Azusa"  , "Nakano"  , "Gt2", 16),
-    ]
+    )
 
-    def setUp(self):
-        macaron.macaronage(DB_FILE, lazy=True)
-        macaron.create_table(Team)
-        macaron.create_table(Member)
-        macaron.create_table(Song)
+    tables = (Team, Member, Song)
 
     def tearDown(self):
         macaron.SQL_TRACE_OUT = None
-        macaron.bake()
-        macaron.cleanup()
+        SharedTablesTestCase.tearDown(self)
+
+    def _create_members(self):
+        """Creates the team and its members in a transaction"""
+        with macaron.transaction("IMMEDIATE"):
+            team = Team.create(name="Houkago Tea Time")
+            Member.bulk_create([dict(zip(self.fields, name), band=team) for name in self.names])
+        return team
 
     def testBorderValues(self):
         azusa = Member.create(first_name="Azusa", last_name="Nakano", part="Gt2", age=16)
@@ -39,6 +40,8 @@ class TestQueryOperation(unittest.TestCase):
         def _age_underrun(): azusa.age = 14
         self.assertRaises(macaron.ValidationError, _age_exceeded)
         self.assertRaises(macaron.ValidationError, _age_underrun)
+        def _age_is_not_integer(): azusa.age = "sixteen"
+        self.assertRaises(macaron.ValidationError, _age_is_not_integer)
 
         def _too_long_part_name(): azusa.part = "1234567890A"
         self.assertRaises(macaron.ValidationError, _too_long_part_name)
@@ -47,14 +50,13 @@ class TestQueryOperation(unittest.TestCase):
         self.assertRaises(macaron.ValidationError, _name_is_not_set)
 
     def testManyToManyOperation(self):
-        team = Team.create(name="Houkago Tea Time")
-        for name in self.names:
-            team.members.append(first_name=name[0], last_name=name[1], part=name[2], age=name[3])
-        song1 = Song.create(name="Utauyo!! MIRACLE")
-        song2 = Song.create(name="Tenshi ni Fureta yo!")
-
-        for m in Member.all(): song1.members.append(m)
-        for m in Member.select(age=17): song2.members.append(m)
+        team = self._create_members()
+        self.assertEqual(team.members.count(), 5)
+        with macaron.transaction("IMMEDIATE"):
+            song1 = Song.create(name="Utauyo!! MIRACLE")
+            song2 = Song.create(name="Tenshi ni Fureta yo!")
+            song1.members.extend(Member.all())
+            song2.members.extend(Member.select(age=17))
 
         members = song1.members
         self.assertEqual(members.count(), 5)
@@ -68,9 +70,7 @@ class TestQueryOperation(unittest.TestCase):
         self.assertEqual(songs[0].name, "Utauyo!! MIRACLE")
 
     def testLimitOffset(self):
-        team = Team.create(name="Houkago Tea Time")
-        for name in self.names:
-            team.members.append(first_name=name[0], last_name=name[1], part=name[2], age=name[3])
+        self._create_members()
 
         # OFFSET 2
         qs = Member.all().offset(2).order_by("id")
@@ -3,22 +3,17 @@
 # test all
 
 import unittest
-import sys, os, glob
+import sys, os
 
 test_root = os.path.dirname(os.path.abspath(__file__))
-test_files = glob.glob(os.path.join(test_root, "test_*.py"))
 
 os.chdir(test_root)
 sys.path.insert(0, os.path.dirname(test_root))
 sys.path.insert(0, test_root)
 
-if len(sys.argv) == 2:
-    test_names = ["test_%s" % sys.argv[1]]
-else:
-    test_files = glob.glob(os.path.join(test_root, "test_*.py"))
-    test_names = [os.path.basename(name)[:-3] for name in test_files]
-
-suite = unittest.defaultTestLoader.loadTestsFromNames(test_names)
+# Each module is loaded once. The old tests in sub directories are not packages, so they are skipped.
+pattern = "test_%s.py" % sys.argv[1] if len(sys.argv) == 2 else "test_*.py"
+suite = unittest.defaultTestLoader.discover(test_root, pattern=pattern, top_level_dir=test_root)
 
 def run():
     import macaron